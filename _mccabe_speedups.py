@@ -0,0 +1,89 @@
+""" Fast path graph sizes for mccabe.
+
+    graph_size() counts the nodes and edges that
+    mccabe.PathCountingAstVisitor finds in the graph of a statement, in a
+    single loop over its nested statements rather than a walk of visit
+    methods.  The module is plain Python, compiled with mypyc when mccabe
+    is built with MCCABE_MYPYC=1, and mccabe falls back to its visitors
+    when the module is not installed.
+"""
+from typing import Any, Dict, List, Optional, Tuple
+
+from mccabe import _STATEMENT_KINDS
+
+_SIMPLE = 0
+_BRANCH = 1
+_TRY = 2
+_FUNCTION = 3
+_CLASS = 4
+_WITH = 5
+
+# What each class of statement adds to a graph, looked up by exact class
+# as the visitors look up their visit methods.  Any other statement is
+# simple: one path node and the edge to it.
+_CODES = {"If": _BRANCH, "Loop": _BRANCH, "TryExcept": _TRY,
+          "Function": _FUNCTION, "Class": _CLASS, "With": _WITH}
+_KINDS: Dict[type, int] = dict((klass, _CODES[kind])
+                               for klass, kind in _STATEMENT_KINDS.items())
+
+
+def _body_size(body: List[Any], nodes: int, edges: int,
+               limit: Optional[int]) -> Tuple[int, int]:
+    """Return (nodes, edges) with those the statements of a body add to the
+    graph they are in.
+
+    Every statement adds the same counts wherever it is, so the bodies are
+    taken from a stack in any order, and nesting cannot exhaust the
+    recursion limit.  No statement lowers the complexity, so once it is
+    over limit the rest are left uncounted.
+    """
+    stack: List[List[Any]] = [body]
+    kinds = _KINDS
+    while stack:
+        if limit is not None and edges - nodes + 2 > limit:
+            break
+        for node in stack.pop():
+            kind = kinds.get(type(node), _SIMPLE)
+            if kind == _SIMPLE:
+                nodes += 1
+                edges += 1
+            elif kind == _BRANCH:
+                # a path node, and a bottom node joined to the body, the
+                # statement itself and the `else` block, if any
+                nodes += 2
+                edges += 3
+                stack.append(node.body)
+                stack.append(node.orelse)
+            elif kind == _FUNCTION:
+                # a closure: a path node and a bottom node joined to it
+                nodes += 2
+                edges += 3
+                stack.append(node.body)
+            elif kind == _TRY:
+                handlers = node.handlers
+                nodes += 2
+                edges += 3 + len(handlers)
+                stack.append(node.body)
+                for handler in handlers:
+                    stack.append(handler.body)
+                stack.append(node.orelse)
+            elif kind == _CLASS:
+                stack.append(node.body)
+            else:
+                nodes += 1
+                edges += 1
+                stack.append(node.body)
+    return nodes, edges
+
+
+def graph_size(node: Any, limit: Optional[int] = None) -> Tuple[int, int]:
+    """Return the (nodes, edges) of the graph a function, or a loop, `if`
+    or `try` outside of any function, makes.
+
+    If limit is given, counting stops once the complexity of the graph is
+    over it, as for a PathCountingAstVisitor with that limit.
+    """
+    if _KINDS.get(type(node)) == _FUNCTION:
+        return _body_size(node.body, 1, 0, limit)
+    # The statement starts the graph instead of joining one.
+    return _body_size([node], 0, -1, limit)
@@ -0,0 +1,438 @@
+""" Benchmarks for mccabe.
+
+    Run with ``python bench_mccabe.py [benchmark ...]``.  Each result is
+    printed as it is measured; ``--json FILE`` also saves them, and
+    ``--compare FILE`` prints how they changed since a saved run.
+"""
+import ast
+import functools
+import json
+import optparse
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tokenize
+import tracemalloc
+
+import mccabe
+
+
+# Large standard library modules that have been around for a long time.
+STDLIB_MODULES = ('argparse', 'inspect', 'subprocess', 'tarfile', 'typing')
+
+
+def deep_elif_tree(depth):
+    """Return a module holding one function with a `depth` long elif chain.
+
+    The tree is built directly because the parser itself gives up on
+    sources nested this deeply.
+    """
+    orelse = []
+    for i in range(depth, 0, -1):
+        line = 2 * i
+        test = ast.Name(id='x', ctx=ast.Load(), lineno=line, col_offset=7)
+        body = [ast.Pass(lineno=line + 1, col_offset=8)]
+        orelse = [ast.If(test=test, body=body, orelse=orelse,
+                         lineno=line, col_offset=4)]
+    tree = ast.parse('def f(x):\n    pass\n')
+    tree.body[0].body = orelse
+    return tree
+
+
+def deep_nested_tree(depth):
+    """Return a module holding one function with `depth` nested loops."""
+    body = [ast.Pass(lineno=depth + 2, col_offset=4)]
+    for i in range(depth, 0, -1):
+        target = ast.Name(id='x', ctx=ast.Store(), lineno=i + 1, col_offset=8)
+        iter_ = ast.Name(id='x', ctx=ast.Load(), lineno=i + 1, col_offset=13)
+        body = [ast.For(target=target, iter=iter_, body=body, orelse=[],
+                        lineno=i + 1, col_offset=4)]
+    tree = ast.parse('def f(x):\n    pass\n')
+    tree.body[0].body = body
+    return tree
+
+
+def flat_module(functions):
+    """Return the source of a module of `functions` small functions."""
+    return ''.join(
+        'def f%d(x):\n'
+        '    y = x + %d\n'
+        '    if y:\n'
+        '        return y\n'
+        '    return x\n' % (i, i) for i in range(functions))
+
+
+def literal_module(rows):
+    """Return the source of a data-heavy module: a table of `rows` literals,
+    a class of `rows` constants, and a function of `rows` assignments.
+    """
+    return ('TABLE = [\n%s]\n\n\nclass Constants:\n%s\n\ndef load(x):\n%s'
+            '    if x:\n        return TABLE\n    return x\n' % (
+                ''.join('    (%d, %r, %d.5),\n' % (i, str(i), i)
+                        for i in range(rows)),
+                ''.join('    C%d = %d\n' % (i, i) for i in range(rows)),
+                ''.join('    x%d = x + %d\n' % (i, i) for i in range(rows))))
+
+
+def corpora():
+    """Yield (name, tree) for the corpora the benchmarks run on."""
+    for module in STDLIB_MODULES:
+        filename = os.path.join(os.path.dirname(os.__file__), module + '.py')
+        code = mccabe._read(filename)
+        yield ('stdlib:' + module,
+               compile(code, filename, 'exec', ast.PyCF_ONLY_AST))
+    yield 'deep:elif-1000', deep_elif_tree(1000)
+    yield 'deep:nested-1000', deep_nested_tree(1000)
+    yield 'flat:20000', ast.parse(flat_module(20000))
+
+
+def best_of(repeat, func, *args):
+    """Return the best wall time of `repeat` calls of func(*args)."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def _walk(visitor_class, engine, tree):
+    visitor = visitor_class()
+    getattr(visitor, engine)(tree, visitor)
+    return visitor
+
+
+def _array_graphing_visitor():
+    return mccabe.PathGraphingAstVisitor(mccabe.ArrayPathGraph)
+
+
+_array_graphing_visitor.__name__ = 'PathGraphingAstVisitor[array]'
+
+# The ways of computing complexity that are compared.
+VISITORS = (mccabe.PathGraphingAstVisitor, _array_graphing_visitor,
+            mccabe.PathCountingAstVisitor)
+
+
+def _check(tree):
+    checker = mccabe.McCabeChecker(tree, 'bench.py', max_complexity=0)
+    for _ in checker.run():
+        pass
+
+
+def bench_checker(repeat):
+    """Time McCabeChecker.run on each corpus."""
+    for case, tree in corpora():
+        yield case, 'seconds', best_of(repeat, _check, tree)
+
+
+def _gate(tree, **modes):
+    checker = mccabe.McCabeChecker(tree, 'bench.py', max_complexity=10,
+                                   **modes)
+    for _ in checker.run():
+        pass
+
+
+def bench_gate(repeat):
+    """Time the checker at --max-complexity 10, as a pre-commit gate, with
+    and without stopping early.
+    """
+    for case, tree in corpora():
+        for mode, modes in (('full', {}),
+                            ('early-exit', {'early_exit': True}),
+                            ('fail-fast', {'early_exit': True,
+                                           'fail_fast': True})):
+            seconds = best_of(repeat, functools.partial(_gate, **modes),
+                              tree)
+            yield '%s/%s' % (case, mode), 'seconds', seconds
+
+
+def _graphs(tree, visitor=None):
+    for graph in mccabe.iter_graphs(tree, visitor):
+        graph.complexity()
+
+
+def bench_speedups(repeat):
+    """Compare the _mccabe_speedups accelerator, compiled or not, with the
+    counting visitor it stands in for.
+    """
+    speedups = mccabe._speedups()
+    if speedups is None:
+        return
+    compiled = not speedups.__file__.endswith('.py')
+    name = 'speedups[mypyc]' if compiled else 'speedups'
+    for case, tree in corpora():
+        yield ('%s/visitor' % case, 'seconds',
+               best_of(repeat, lambda: _graphs(
+                   tree, mccabe.PathCountingAstVisitor())))
+        yield '%s/%s' % (case, name), 'seconds', best_of(repeat, _graphs,
+                                                         tree)
+
+
+def bench_throughput(repeat):
+    """Measure AST nodes visited per second by each visitor."""
+    for case, tree in corpora():
+        nodes = sum(1 for _ in ast.walk(tree))
+        for visitor_class in VISITORS:
+            seconds = best_of(repeat, _walk, visitor_class,
+                              'iterative_preorder', tree)
+            yield ('%s/%s' % (case, visitor_class.__name__), 'nodes/s',
+                   nodes / seconds)
+
+
+def bench_memory(repeat):
+    """Measure the peak memory per graph that each visitor allocates."""
+    for case, tree in corpora():
+        for visitor_class in VISITORS:
+            tracemalloc.start()
+            try:
+                visitor = _walk(visitor_class, 'iterative_preorder', tree)
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+            yield ('%s/%s' % (case, visitor_class.__name__), 'bytes/graph',
+                   peak / max(len(visitor.graphs), 1))
+
+
+def _stream(visitor_class, tree):
+    for graph in mccabe.iter_graphs(tree, visitor_class()):
+        graph.complexity()
+
+
+def _batch(visitor_class, tree):
+    for graph in _walk(visitor_class, 'iterative_preorder', tree).graphs.values():
+        graph.complexity()
+
+
+def bench_streaming(repeat):
+    """Compare the peak memory of iter_graphs with keeping every graph."""
+    tree = ast.parse(flat_module(20000))
+    for visitor_class in VISITORS:
+        for walk in (_batch, _stream):
+            tracemalloc.start()
+            try:
+                walk(visitor_class, tree)
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+            case = '%s.%s' % (visitor_class.__name__, walk.__name__[1:])
+            yield 'flat:20000/' + case, 'bytes', peak
+
+
+class _UnprunedCountingVisitor(mccabe.PathCountingAstVisitor):
+    """Visits every statement, as the counting visitor used to."""
+
+    def _prune(self, body):
+        return body
+
+
+class _UnprunedGraphingVisitor(mccabe.PathGraphingAstVisitor):
+    """Visits every statement, as the graphing visitor used to."""
+
+    def _prune(self, body):
+        return body
+
+
+def bench_pruning(repeat):
+    """Measure the statements visited per second on literal-heavy modules,
+    with and without leaving out those that cannot change complexity.
+    """
+    for rows in (1000, 20000):
+        tree = ast.parse(literal_module(rows))
+        statements = sum(isinstance(node, ast.stmt) for node in ast.walk(tree))
+        for visitor_class in (_UnprunedGraphingVisitor,
+                              mccabe.PathGraphingAstVisitor,
+                              _UnprunedCountingVisitor,
+                              mccabe.PathCountingAstVisitor):
+            seconds = best_of(repeat, _walk, visitor_class,
+                              'iterative_preorder', tree)
+            yield ('literal-%d/%s' % (rows, visitor_class.__name__),
+                   'statements/s', statements / seconds)
+
+
+def bench_walkers(repeat):
+    """Compare the recursive and iterative walkers on deep trees."""
+    for shape, make_tree in (('elif', deep_elif_tree),
+                             ('nested', deep_nested_tree)):
+        for depth in (100, 1000, 10000):
+            tree = make_tree(depth)
+            for visitor_class in (mccabe.PathGraphingAstVisitor,
+                                  mccabe.PathCountingAstVisitor):
+                for engine in ('preorder', 'iterative_preorder'):
+                    try:
+                        seconds = best_of(repeat, _walk, visitor_class,
+                                          engine, tree)
+                    except RecursionError:
+                        # Reported as a missing value.
+                        seconds = None
+                    yield ('%s-%d/%s.%s' % (shape, depth,
+                                            visitor_class.__name__, engine),
+                           'seconds', seconds)
+
+
+def bench_cli(repeat):
+    """Time `python -m mccabe` on an empty file, i.e. its startup cost."""
+    fd, filename = tempfile.mkstemp(suffix='.py')
+    os.close(fd)
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, PYTHONPATH=here)
+    command = [sys.executable, '-m', 'mccabe', filename]
+    run = functools.partial(subprocess.check_call, command, env=env)
+    try:
+        yield 'empty-file', 'seconds', best_of(repeat, run)
+    finally:
+        os.unlink(filename)
+
+
+def _legacy_read(filename):
+    """The reader mccabe used to have, which opened each file twice."""
+    try:
+        with open(filename, 'rb') as f:
+            (encoding, _) = tokenize.detect_encoding(f.readline)
+    except (LookupError, SyntaxError, UnicodeError):
+        with open(filename, encoding='latin-1') as f:
+            return f.read()
+    with open(filename, 'r', encoding=encoding) as f:
+        return f.read()
+
+
+def _source(filename):
+    return mccabe._source(mccabe._read_bytes(filename))
+
+
+def _read_all(read, filenames):
+    for filename in filenames:
+        read(filename)
+
+
+def bench_io(repeat):
+    """Measure files read per second across the standard library tree."""
+    root = os.path.dirname(os.__file__)
+    filenames = list(mccabe._iter_python_files([root]))
+    for read in (_legacy_read, mccabe._read, _source):
+        seconds = best_of(repeat, _read_all, read, filenames)
+        yield ('stdlib-%d/%s' % (len(filenames), read.__name__), 'files/s',
+               len(filenames) / seconds)
+
+
+def _lookup_all(baseline, entries):
+    for filename, entity, _ in entries:
+        baseline.get(filename, entity)
+
+
+def bench_baseline(repeat):
+    """Measure opening a baseline and looking functions up in it."""
+    directory = tempfile.mkdtemp()
+    try:
+        for size in (1000, 100000):
+            entries = [('pkg/m%d.py' % (i // 50), 'f%d' % i, i % 30 + 1)
+                       for i in range(size)]
+            path = os.path.join(directory, 'baseline-%d' % size)
+            mccabe.Baseline.write(path, entries)
+            yield ('%d/open' % size, 'seconds',
+                   best_of(repeat, lambda: mccabe.Baseline(path).close()))
+            baseline = mccabe.Baseline(path)
+            sample = entries[::max(size // 1000, 1)]
+            seconds = best_of(repeat, _lookup_all, baseline, sample)
+            baseline.close()
+            yield '%d/get' % size, 'seconds', seconds / len(sample)
+    finally:
+        shutil.rmtree(directory)
+
+
+_IMPORTED = ("import sys; before = set(sys.modules); import mccabe; "
+             "print(len(set(sys.modules) - before))")
+
+
+def bench_import(repeat):
+    """Measure what `import mccabe` costs, as flake8 pays it on start-up."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    cache = tempfile.mkdtemp()
+    env = dict(os.environ, PYTHONPATH=here, PYTHONPYCACHEPREFIX=cache)
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    command = [sys.executable, '-X', 'importtime', '-c', 'import mccabe']
+    best = None
+    try:
+        # The first run writes the bytecode cache.
+        for _ in range(repeat + 1):
+            output = subprocess.run(command, env=env, check=True,
+                                    stderr=subprocess.PIPE).stderr
+            # The last line holds the cumulative microseconds of mccabe.
+            micros = int(output.splitlines()[-1].split(b'|')[1])
+            best = micros if best is None else min(best, micros)
+        modules = subprocess.check_output([sys.executable, '-c', _IMPORTED],
+                                          env=env)
+    finally:
+        shutil.rmtree(cache)
+    yield 'import', 'seconds', best / 1e6
+    yield 'import', 'modules', int(modules)
+
+
+BENCHMARKS = {
+    'checker': bench_checker,
+    'gate': bench_gate,
+    'throughput': bench_throughput,
+    'memory': bench_memory,
+    'walkers': bench_walkers,
+    'cli': bench_cli,
+    'import': bench_import,
+    'io': bench_io,
+    'streaming': bench_streaming,
+    'pruning': bench_pruning,
+    'baseline': bench_baseline,
+    'speedups': bench_speedups,
+}
+
+
+def compare(results, baseline):
+    """Print the ratio of each result to the same one in baseline."""
+    old = dict(((r['benchmark'], r['case'], r['metric']), r['value'])
+               for r in baseline['results'])
+    for result in results:
+        key = (result['benchmark'], result['case'], result['metric'])
+        if old.get(key) and result['value'] is not None:
+            ratio = result['value'] / old[key]
+            print('%s %s %s: %.2fx' % (key + (ratio,)))
+
+
+def main(argv=None):
+    opar = optparse.OptionParser(
+        usage="%prog [options] [benchmark ...]",
+        description="Benchmarks: " + ", ".join(sorted(BENCHMARKS)))
+    opar.add_option("-r", "--repeat", dest="repeat", type="int", default=5,
+                    help="number of timing runs to take the best of")
+    opar.add_option("--json", dest="json",
+                    help="save the results to this file")
+    opar.add_option("--compare", dest="compare",
+                    help="compare the results with those saved in this file")
+    options, args = opar.parse_args(argv)
+    names = args or sorted(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            opar.error("unknown benchmark: %s" % name)
+
+    results = []
+    for name in names:
+        for case, metric, value in BENCHMARKS[name](options.repeat):
+            results.append(dict(benchmark=name, case=case, metric=metric,
+                                value=value))
+            print('%s %s %s %s' % (name, case, metric, value))
+
+    if options.json:
+        with open(options.json, 'w') as f:
+            json.dump({'mccabe': mccabe.__version__,
+                       'python': platform.python_version(),
+                       'implementation': platform.python_implementation(),
+                       'results': results}, f, indent=2)
+    if options.compare:
+        with open(options.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -3,49 +3,144 @@
     http://nedbatchelder.com/blog/200803/python_code_complexity_microtool.html
     MIT License.
 """
-from __future__ import with_statement
-
-import optparse
+import ast
+import functools
+import io
+import os
 import sys
-import tokenize
+import time
+
+from array import array
+from ast import iter_child_nodes
+from collections import OrderedDict, defaultdict, deque, namedtuple
+from types import GeneratorType
 
-from collections import defaultdict
-try:
-    import ast
-    from ast import iter_child_nodes
-except ImportError:   # Python 2.5
-    from flake8.util import ast, iter_child_nodes
+# Modules only needed by the command line tool, the caches, the server and
+# the other optional features are imported where they are used, so that
+# loading the flake8 plugin stays cheap.
 
 __version__ = '0.7.0'
 
 
+def visit_method(walk):
+    """Make a visit method of a generator function that yields iterables
+    of child nodes to be visited before it is resumed.
+
+    Called directly, as by an override calling super(), the method visits
+    those children before it returns.  The walkers resume the generator
+    themselves instead, unless a subclass overrides the method.
+    """
+    @functools.wraps(walk)
+    def visit(self, node, *args):
+        for children in walk(self, node, *args):
+            for child in children:
+                self.dispatch(child, *args)
+    visit.walk = walk
+    return visit
+
+
 class ASTVisitor(object):
-    """Performs a depth-first walk of the AST."""
+    """Performs a depth-first walk of the AST.
+
+    A visit method does all of its work when called.  Those made with
+    :func:`visit_method` leave their children to the walker instead:
+    :meth:`preorder` visits them recursively, while
+    :meth:`iterative_preorder` keeps the suspended visit methods on an
+    explicit stack so that deeply nested code cannot exhaust Python's
+    recursion limit.
+
+    The visit function for each class of node is looked up once per
+    visitor class, and the table is shared by all of its instances.  A
+    visitor with visit methods set on the instance itself gets a table of
+    its own for each walk instead, in which those come first.
+    """
+
+    # Maps each visitor class to its table of node class -> visit function.
+    _dispatch_tables = {}
 
     def __init__(self):
         self.node = None
-        self._cache = {}
+        self._cache = self._dispatch_table(type(self))
+
+    @classmethod
+    def _dispatch_table(cls, visitor_class):
+        return cls._dispatch_tables.setdefault(visitor_class, {})
 
+    @visit_method
     def default(self, node, *args):
-        for child in iter_child_nodes(node):
-            self.dispatch(child, *args)
+        yield iter_child_nodes(node)
 
-    def dispatch(self, node, *args):
+    def _visit(self, node, args):
         self.node = node
         klass = node.__class__
         meth = self._cache.get(klass)
         if meth is None:
-            className = klass.__name__
-            meth = getattr(self.visitor, 'visit' + className, self.default)
+            meth = self._lookup('visit' + klass.__name__)
             self._cache[klass] = meth
-        return meth(node, *args)
+        return meth(self.visitor, node, *args)
+
+    def _lookup(self, name):
+        """Return the visit function called name, taking the visitor first"""
+        own = self._own_visit_methods(self.visitor).get(name)
+        if own is not None:
+            return lambda visitor, *args: own(*args)
+        meth = getattr(type(self.visitor), name, type(self).default)
+        return getattr(meth, 'walk', meth)
+
+    @staticmethod
+    def _own_visit_methods(visitor):
+        return dict((name, value)
+                    for name, value in getattr(visitor, '__dict__', {}).items()
+                    if name.startswith('visit') and name != 'visit')
+
+    def _walk_table(self, visitor):
+        """Return the dispatch table for a walk with visitor"""
+        if self._own_visit_methods(visitor):
+            return {}
+        return self._dispatch_table(type(visitor))
+
+    def dispatch(self, node, *args):
+        result = self._visit(node, args)
+        if type(result) is GeneratorType:
+            for children in result:
+                for child in children:
+                    self.dispatch(child, *args)
+            return None
+        return result
 
     def preorder(self, tree, visitor, *args):
         """Do preorder walk of tree using visitor"""
         self.visitor = visitor
+        self._cache = self._walk_table(visitor)
         visitor.visit = self.dispatch
         self.dispatch(tree, *args)  # XXX *args make sense?
 
+    def iterative_preorder(self, tree, visitor, *args):
+        """Do preorder walk of tree using visitor, without recursing"""
+        self.visitor = visitor
+        self._cache = self._walk_table(visitor)
+        visitor.visit = self.dispatch
+        done = object()
+        generators = []
+        children = []
+        result = self._visit(tree, args)
+        if type(result) is GeneratorType:
+            generators.append(result)
+            children.append(iter(()))
+        while generators:
+            child = next(children[-1], done)
+            if child is done:
+                try:
+                    children[-1] = iter(next(generators[-1]))
+                except StopIteration:
+                    generators.pop()
+                    children.pop()
+                continue
+            result = self._visit(child, args)
+            if type(result) is GeneratorType:
+                generators.append(result)
+                children.append(iter(()))
+
 
 class PathNode(object):
     def __init__(self, name, look="circle"):
@@ -68,6 +163,12 @@ class PathGraph(object):
         self.column = column
         self.nodes = defaultdict(list)
 
+    def new_node(self, kind, lineno=None, look="circle"):
+        """Return a new node labelled with kind and, if given, lineno"""
+        if lineno is not None:
+            kind = "%s %d" % (kind, lineno)
+        return PathNode(kind, look)
+
     def connect(self, n1, n2):
         self.nodes[n1].append(n2)
         # Ensure that the destination node is always counted.
@@ -82,22 +183,202 @@ class PathGraph(object):
                 print('%s -- %s;' % (node.dot_id(), next.dot_id()))
         print('}')
 
+    def write_dot(self, writer):
+        """Write the graph to a DotWriter"""
+        ids = {}
+        writer.write('subgraph {')
+        for node in self.nodes:
+            ids[node] = writer.new_id()
+            writer.write('node [shape=%s,label="%s"] %d;' % (
+                node.look, node.name, ids[node]))
+        for node, nexts in self.nodes.items():
+            for next in nexts:
+                writer.write('%d -- %d;' % (ids[node], ids[next]))
+        writer.write('}')
+
     def complexity(self):
         """ Return the McCabe complexity for the graph.
             E-V+2
         """
-        num_edges = sum([len(n) for n in self.nodes.values()])
-        num_nodes = len(self.nodes)
+        num_nodes, num_edges = self.size()
         return num_edges - num_nodes + 2
 
+    def size(self):
+        """Return the numbers of nodes and edges in the graph"""
+        return len(self.nodes), sum([len(n) for n in self.nodes.values()])
+
+
+class ArrayPathGraph(object):
+    """A path graph that keeps its nodes and edges in arrays of integers.
+
+    Nodes are indices.  Each one is stored as a kind code and a line
+    number, from which its label is built only when the graph is written
+    out, and edges are stored as parallel arrays of source and target
+    indices.  It has the interface of PathGraph, apart from `nodes`.
+    """
+
+    KINDS = ("", "Stmt", "Loop", "If", "TryExcept", "With")
+    _KIND_CODES = dict((kind, code) for code, kind in enumerate(KINDS)
+                       if kind)
+    # The code of nodes whose label is kept in _labels.
+    _LABELLED = -1
+
+    def __init__(self, name, entity, lineno, column=0):
+        self.name = name
+        self.entity = entity
+        self.lineno = lineno
+        self.column = column
+        self._kinds = array('b')
+        self._lines = array('i')
+        self._labels = {}
+        self._connected = bytearray()
+        self._num_nodes = 0
+        self._sources = array('i')
+        self._targets = array('i')
+
+    def new_node(self, kind, lineno=None, look="circle"):
+        """Return a new node labelled with kind and, if given, lineno"""
+        index = len(self._kinds)
+        if lineno is not None:
+            code = self._KIND_CODES.get(kind, self._LABELLED)
+        elif kind == "" and look == "point":
+            code = 0
+        else:
+            code = self._LABELLED
+        if code == self._LABELLED:
+            self._labels[index] = (kind, lineno, look)
+        self._kinds.append(code)
+        self._lines.append(lineno or 0)
+        self._connected.append(0)
+        return index
+
+    def connect(self, n1, n2):
+        self._sources.append(n1)
+        self._targets.append(n2)
+        for node in (n1, n2):
+            if not self._connected[node]:
+                self._connected[node] = 1
+                self._num_nodes += 1
+
+    def _label(self, node):
+        """Return the look and label of a node"""
+        code = self._kinds[node]
+        if code == 0:
+            return "point", ""
+        if code > 0:
+            return "circle", "%s %d" % (self.KINDS[code], self._lines[node])
+        kind, lineno, look = self._labels[node]
+        if lineno is not None:
+            kind = "%s %d" % (kind, lineno)
+        return look, kind
+
+    def write_dot(self, writer):
+        """Write the graph to a DotWriter, in the same order as PathGraph"""
+        ids = {}
+        for edge in zip(self._sources, self._targets):
+            for node in edge:
+                if node not in ids:
+                    ids[node] = writer.new_id()
+        writer.write('subgraph {')
+        for node, node_id in ids.items():
+            writer.write('node [shape=%s,label="%s"] %d;' % (
+                self._label(node) + (node_id,)))
+        # Edges are grouped by their source, as in PathGraph.nodes.
+        for edge in sorted(range(len(self._sources)),
+                           key=lambda edge: ids[self._sources[edge]]):
+            writer.write('%d -- %d;' % (ids[self._sources[edge]],
+                                        ids[self._targets[edge]]))
+        writer.write('}')
+
+    def to_dot(self):
+        """Print the graph, numbering its nodes from 1.  Use a shared
+        DotWriter to put several graphs in one DOT graph.
+        """
+        writer = DotWriter(sys.stdout)
+        self.write_dot(writer)
+        writer.flush()
+
+    def complexity(self):
+        """ Return the McCabe complexity for the graph.
+            E-V+2
+        """
+        return len(self._sources) - self._num_nodes + 2
+
+    def size(self):
+        """Return the numbers of nodes and edges in the graph"""
+        return self._num_nodes, len(self._sources)
+
+
+class DotWriter(object):
+    """Writes path graphs to a text stream as one Graphviz DOT graph.
+
+    Lines are collected and written `batch_size` at a time.  Nodes are
+    numbered in the order they are written rather than by id(), so the
+    same graphs always give the same output.
+    """
+
+    def __init__(self, stream, batch_size=1000):
+        self.stream = stream
+        self.batch_size = batch_size
+        self._lines = []
+        self._next_id = 0
+
+    def new_id(self):
+        """Return the next unused node id"""
+        self._next_id += 1
+        return self._next_id
+
+    def write(self, line):
+        self._lines.append(line)
+        if len(self._lines) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self._lines:
+            self._lines.append('')
+            self.stream.write('\n'.join(self._lines))
+            self._lines = []
+
+    def begin(self):
+        self.write('graph {')
+
+    def end(self):
+        self.write('}')
+        self.flush()
+
+
+def open_output(filename):
+    """Open filename for writing text, gzip-compressed if it ends in .gz"""
+    if filename.endswith('.gz'):
+        import gzip
+        return gzip.open(filename, 'wt', encoding='utf-8')
+    return open(filename, 'w', encoding='utf-8')
+
+
+@functools.lru_cache(maxsize=None)
+def _simple_statements(visitor_class, base):
+    """Return the statement classes visitor_class has no visit method for.
+
+    Each of them adds one node and one edge to the graph it is in, which
+    never changes its complexity, and nothing outside of a graph.  None are
+    returned if visitor_class overrides the methods of base that visit
+    them, as those overrides have to see every statement.
+    """
+    for name in ('visitSimpleStatement', 'default'):
+        if getattr(visitor_class, name) is not getattr(base, name):
+            return frozenset()
+    return frozenset(klass for klass in ast.stmt.__subclasses__()
+                     if not hasattr(visitor_class, 'visit' + klass.__name__))
+
 
 class PathGraphingAstVisitor(ASTVisitor):
     """ A visitor for a parsed Abstract Syntax Tree which finds executable
         statements.
     """
 
-    def __init__(self):
+    def __init__(self, graph_class=PathGraph):
         super(PathGraphingAstVisitor, self).__init__()
+        self.graph_class = graph_class
         self.classname = ""
         self.graphs = {}
         self.reset()
@@ -106,10 +387,30 @@ class PathGraphingAstVisitor(ASTVisitor):
         self.graph = None
         self.tail = None
 
+    def _new_graph(self, name, entity, node):
+        self.graph = self.graph_class(name, entity, node.lineno,
+                                      node.col_offset)
+
+    def _store_graph(self, key):
+        self.graphs[key] = self.graph
+        self.reset()
+
     def dispatch_list(self, node_list):
         for node in node_list:
             self.dispatch(node)
 
+    def _prune(self, body):
+        """Leave the simple statements out of a body outside of any graph."""
+        if self.graph is not None:
+            return body
+        simple = _simple_statements(type(self), PathGraphingAstVisitor)
+        return [node for node in body if node.__class__ not in simple]
+
+    @visit_method
+    def visitModule(self, node):
+        yield self._prune(node.body)
+
+    @visit_method
     def visitFunctionDef(self, node):
 
         if self.classname:
@@ -123,31 +424,31 @@ class PathGraphingAstVisitor(ASTVisitor):
             # closure
             pathnode = self.appendPathNode(name)
             self.tail = pathnode
-            self.dispatch_list(node.body)
-            bottom = PathNode("", look='point')
+            yield node.body
+            bottom = self.graph.new_node("", look='point')
             self.graph.connect(self.tail, bottom)
             self.graph.connect(pathnode, bottom)
             self.tail = bottom
         else:
-            self.graph = PathGraph(name, entity, node.lineno, node.col_offset)
-            pathnode = PathNode(name)
+            self._new_graph(name, entity, node)
+            pathnode = self.graph.new_node(name)
             self.tail = pathnode
-            self.dispatch_list(node.body)
-            self.graphs["%s%s" % (self.classname, node.name)] = self.graph
-            self.reset()
+            yield node.body
+            self._store_graph("%s%s" % (self.classname, node.name))
 
     visitAsyncFunctionDef = visitFunctionDef
 
+    @visit_method
     def visitClassDef(self, node):
         old_classname = self.classname
         self.classname += node.name + "."
-        self.dispatch_list(node.body)
+        yield self._prune(node.body)
         self.classname = old_classname
 
-    def appendPathNode(self, name):
-        if not self.tail:
+    def appendPathNode(self, name, lineno=None):
+        if self.tail is None:
             return
-        pathnode = PathNode(name)
+        pathnode = self.graph.new_node(name, lineno)
         self.graph.connect(self.tail, pathnode)
         self.tail = pathnode
         return pathnode
@@ -157,131 +458,1204 @@ class PathGraphingAstVisitor(ASTVisitor):
             lineno = 0
         else:
             lineno = node.lineno
-        name = "Stmt %d" % lineno
-        self.appendPathNode(name)
+        self.appendPathNode("Stmt", lineno)
 
+    @visit_method
     def default(self, node, *args):
         if isinstance(node, ast.stmt):
             self.visitSimpleStatement(node)
-        else:
-            super(PathGraphingAstVisitor, self).default(node, *args)
+        elif not isinstance(node, ast.expr):
+            # expressions hold no statements
+            yield iter_child_nodes(node)
 
+    @visit_method
     def visitLoop(self, node):
-        name = "Loop %d" % node.lineno
-        self._subgraph(node, name)
+        return self._subgraph(node, "Loop")
 
     visitAsyncFor = visitFor = visitWhile = visitLoop
 
+    @visit_method
     def visitIf(self, node):
-        name = "If %d" % node.lineno
-        self._subgraph(node, name)
+        return self._subgraph(node, "If")
 
-    def _subgraph(self, node, name, extra_blocks=()):
+    def _subgraph(self, node, kind, extra_blocks=()):
         """create the subgraphs representing any `if` and `for` statements"""
         if self.graph is None:
             # global loop
-            self.graph = PathGraph(name, name, node.lineno, node.col_offset)
-            pathnode = PathNode(name)
-            self._subgraph_parse(node, pathnode, extra_blocks)
-            self.graphs["%s%s" % (self.classname, name)] = self.graph
-            self.reset()
+            name = "%s %d" % (kind, node.lineno)
+            self._new_graph(name, name, node)
+            pathnode = self.graph.new_node(kind, node.lineno)
+            yield from self._subgraph_parse(node, pathnode, extra_blocks)
+            self._store_graph("%s%s" % (self.classname, name))
         else:
-            pathnode = self.appendPathNode(name)
-            self._subgraph_parse(node, pathnode, extra_blocks)
+            pathnode = self.appendPathNode(kind, node.lineno)
+            yield from self._subgraph_parse(node, pathnode, extra_blocks)
 
     def _subgraph_parse(self, node, pathnode, extra_blocks):
         """parse the body and any `else` block of `if` and `for` statements"""
         loose_ends = []
         self.tail = pathnode
-        self.dispatch_list(node.body)
+        yield node.body
         loose_ends.append(self.tail)
         for extra in extra_blocks:
             self.tail = pathnode
-            self.dispatch_list(extra.body)
+            yield extra.body
             loose_ends.append(self.tail)
         if node.orelse:
             self.tail = pathnode
-            self.dispatch_list(node.orelse)
+            yield node.orelse
             loose_ends.append(self.tail)
         else:
             loose_ends.append(pathnode)
-        if pathnode:
-            bottom = PathNode("", look='point')
+        if pathnode is not None:
+            bottom = self.graph.new_node("", look='point')
             for le in loose_ends:
                 self.graph.connect(le, bottom)
             self.tail = bottom
 
+    @visit_method
     def visitTryExcept(self, node):
-        name = "TryExcept %d" % node.lineno
-        self._subgraph(node, name, extra_blocks=node.handlers)
+        return self._subgraph(node, "TryExcept", extra_blocks=node.handlers)
 
     visitTry = visitTryExcept
 
+    @visit_method
     def visitWith(self, node):
-        name = "With %d" % node.lineno
-        self.appendPathNode(name)
-        self.dispatch_list(node.body)
+        self.appendPathNode("With", node.lineno)
+        yield node.body
 
     visitAsyncWith = visitWith
 
 
+class PathCount(object):
+    """The edge and node tallies of a function's path graph.
+
+    Mirrors the parts of :class:`PathGraph` that callers read (``name``,
+    ``entity``, ``lineno``, ``column`` and ``complexity()``) without
+    keeping the graph itself.
+    """
+
+    def __init__(self, name, entity, lineno, column=0):
+        self.name = name
+        self.entity = entity
+        self.lineno = lineno
+        self.column = column
+        self.edges = 0
+        self.nodes = 0
+
+    def complexity(self):
+        """ Return the McCabe complexity for the graph.
+            E-V+2
+        """
+        return self.edges - self.nodes + 2
+
+    def size(self):
+        """Return the numbers of nodes and edges in the graph"""
+        return self.nodes, self.edges
+
+
+class PathCountingAstVisitor(ASTVisitor):
+    """ A visitor that computes the same complexity as
+        :class:`PathGraphingAstVisitor` by counting the edges and nodes the
+        latter would create, without allocating any of them.
+
+        A graph's complexity only grows as it is visited, so if a `limit`
+        is given the rest of a graph is skipped as soon as its complexity
+        goes over it.
+    """
+
+    def __init__(self, limit=None):
+        super(PathCountingAstVisitor, self).__init__()
+        self.limit = limit
+        self.classname = ""
+        self.graphs = {}
+        self.reset()
+
+    def reset(self):
+        self.graph = None
+        self.tail = False
+
+    def _new_graph(self, name, entity, node):
+        self.graph = PathCount(name, entity, node.lineno, node.col_offset)
+        self.graph.nodes = 1
+
+    def _store_graph(self, key):
+        self.graphs[key] = self.graph
+        self.reset()
+
+    def dispatch_list(self, node_list):
+        for node in node_list:
+            self.dispatch(node)
+
+    def _prune(self, body):
+        """Count the node and edge each simple statement of a body adds
+        without visiting it, and return the statements left to visit.
+        """
+        if self.limit is not None and self._over_limit():
+            return []
+        simple = _simple_statements(type(self), PathCountingAstVisitor)
+        kept = [node for node in body if node.__class__ not in simple]
+        if self.tail:
+            skipped = len(body) - len(kept)
+            self.graph.nodes += skipped
+            self.graph.edges += skipped
+        return kept
+
+    def _over_limit(self):
+        return self.graph is not None and self.graph.complexity() > self.limit
+
+    @visit_method
+    def visitModule(self, node):
+        yield self._prune(node.body)
+
+    @visit_method
+    def visitFunctionDef(self, node):
+
+        if self.graph is not None:
+            # closure
+            pathnode = self.appendPathNode()
+            self.tail = pathnode
+            # a bottom node joined to both the tail and the closure node,
+            # counted up front so that a limit is noticed before the body
+            self.graph.nodes += 1
+            self.graph.edges += 2
+            yield self._prune(node.body)
+            self.tail = True
+        else:
+            if self.classname:
+                entity = '%s%s' % (self.classname, node.name)
+            else:
+                entity = node.name
+            name = '%d:%d: %r' % (node.lineno, node.col_offset, entity)
+            self._new_graph(name, entity, node)
+            self.tail = True
+            yield self._prune(node.body)
+            self._store_graph("%s%s" % (self.classname, node.name))
+
+    visitAsyncFunctionDef = visitFunctionDef
+
+    @visit_method
+    def visitClassDef(self, node):
+        old_classname = self.classname
+        self.classname += node.name + "."
+        yield self._prune(node.body)
+        self.classname = old_classname
+
+    def appendPathNode(self):
+        if not self.tail:
+            return False
+        self.graph.edges += 1
+        self.graph.nodes += 1
+        return True
+
+    def visitSimpleStatement(self, node):
+        self.appendPathNode()
+
+    @visit_method
+    def default(self, node, *args):
+        if isinstance(node, ast.stmt):
+            self.visitSimpleStatement(node)
+        elif not isinstance(node, ast.expr):
+            yield iter_child_nodes(node)
+
+    @visit_method
+    def visitLoop(self, node):
+        return self._subgraph(node, "Loop")
+
+    visitAsyncFor = visitFor = visitWhile = visitLoop
+
+    @visit_method
+    def visitIf(self, node):
+        return self._subgraph(node, "If")
+
+    def _subgraph(self, node, kind, extra_blocks=()):
+        """count the subgraphs representing any `if` and `for` statements"""
+        if self.graph is None:
+            # global loop
+            name = "%s %d" % (kind, node.lineno)
+            self._new_graph(name, name, node)
+            yield from self._subgraph_parse(node, True, extra_blocks)
+            self._store_graph("%s%s" % (self.classname, name))
+        else:
+            pathnode = self.appendPathNode()
+            yield from self._subgraph_parse(node, pathnode, extra_blocks)
+
+    def _subgraph_parse(self, node, pathnode, extra_blocks):
+        """count the body and any `else` block of `if` and `for` statements"""
+        if pathnode:
+            # a bottom node joined to every loose end: the body, each extra
+            # block, and either the `else` block or the statement itself
+            self.graph.nodes += 1
+            self.graph.edges += 2 + len(extra_blocks)
+        self.tail = pathnode
+        yield self._prune(node.body)
+        for extra in extra_blocks:
+            self.tail = pathnode
+            yield self._prune(extra.body)
+        if node.orelse:
+            self.tail = pathnode
+            yield self._prune(node.orelse)
+        if pathnode:
+            self.tail = True
+
+    @visit_method
+    def visitTryExcept(self, node):
+        return self._subgraph(node, "TryExcept", extra_blocks=node.handlers)
+
+    visitTry = visitTryExcept
+
+    @visit_method
+    def visitWith(self, node):
+        self.appendPathNode()
+        yield self._prune(node.body)
+
+    visitAsyncWith = visitWith
+
+
+FileTiming = namedtuple(
+    'FileTiming', 'filename parse visit complexity graphs peak_nodes')
+FileTiming.__doc__ = """Seconds spent parsing a file, visiting its tree and
+computing complexities, with its number of graphs and the node count of the
+largest one."""
+
+GraphTiming = namedtuple(
+    'GraphTiming', 'filename entity lineno visit nodes edges')
+GraphTiming.__doc__ = """Seconds spent visiting the tree of one graph, with
+the graph's node and edge counts."""
+
+
+class Profile(object):
+    """Collects timings of the files and graphs mccabe analyzes.
+
+    Pass one to iter_code_complexity or McCabeChecker, or set
+    McCabeChecker.profile for flake8 runs.  Timings are appended to
+    `files` and `graphs` by :meth:`add_file` and :meth:`add_graph`, which
+    a host tool may override to receive them as they are measured.
+    """
+
+    def __init__(self):
+        self.files = []
+        self.graphs = []
+
+    def add_file(self, timing):
+        self.files.append(timing)
+
+    def add_graph(self, timing):
+        self.graphs.append(timing)
+
+    def report(self, out, top=10):
+        """Write the totals and the `top` slowest files and graphs to out"""
+        stages = [sum(timings) for timings in
+                  zip(*[f[1:4] for f in self.files])] or [0.0] * 3
+        print('%d files: parse %.3fs, visit %.3fs, complexity %.3fs' % (
+            (len(self.files),) + tuple(stages)), file=out)
+        print('Slowest files:', file=out)
+        for f in sorted(self.files, key=lambda f: -sum(f[1:4]))[:top]:
+            print('  %.4fs %s (%d graphs, largest %d nodes)' % (
+                sum(f[1:4]), f.filename, f.graphs, f.peak_nodes), file=out)
+        print('Slowest functions:', file=out)
+        for g in sorted(self.graphs, key=lambda g: -g.visit)[:top]:
+            print('  %.4fs %s:%d %r (%d nodes, %d edges)' % (
+                g.visit, g.filename, g.lineno, g.entity, g.nodes, g.edges),
+                file=out)
+
+
+class GraphTimer(object):
+    """Mixin that makes a path graph visitor report how long it spends on
+    each graph to a Profile, e.g.
+    ``class TimedVisitor(GraphTimer, PathGraphingAstVisitor)``.
+    """
+
+    def __init__(self, profile, filename, *args, **kwargs):
+        super(GraphTimer, self).__init__(*args, **kwargs)
+        self.profile = profile
+        self.filename = filename
+        self._started = None
+
+    def _new_graph(self, name, entity, node):
+        self._started = time.perf_counter()
+        super(GraphTimer, self)._new_graph(name, entity, node)
+
+    def _store_graph(self, key):
+        graph = self.graph
+        super(GraphTimer, self)._store_graph(key)
+        elapsed = time.perf_counter() - self._started
+        nodes, edges = graph.size()
+        self.profile.add_graph(GraphTiming(self.filename, graph.entity,
+                                           graph.lineno, elapsed, nodes,
+                                           edges))
+
+
+def _profiled_graphs(tree, filename, profile, parse=0.0, limit=None):
+    """Yield (graph, complexity) for each graph in tree as iter_graphs
+    finds it, reporting the timings to profile.
+
+    Each graph is timed around the step of iter_graphs that counted it, so
+    the _mccabe_speedups accelerator is profiled when it is installed.  The
+    timings of the file are reported once the caller stops taking graphs.
+    """
+    graphs = iter_graphs(tree, limit=limit)
+    visit = compute = 0.0
+    count = peak_nodes = 0
+    try:
+        while True:
+            started = time.perf_counter()
+            graph = next(graphs, None)
+            visited = time.perf_counter()
+            visit += visited - started
+            if graph is None:
+                return
+            complexity = graph.complexity()
+            compute += time.perf_counter() - visited
+            nodes, edges = graph.size()
+            profile.add_graph(GraphTiming(filename, graph.entity, graph.lineno,
+                                          visited - started, nodes, edges))
+            count += 1
+            peak_nodes = max(peak_nodes, nodes)
+            yield graph, complexity
+    finally:
+        profile.add_file(FileTiming(filename, parse, visit, compute, count,
+                                    peak_nodes))
+
+
 class McCabeChecker(object):
-    """McCabe cyclomatic complexity checker."""
+    """McCabe cyclomatic complexity checker.
+
+    flake8 sets the threshold for every checker with parse_options().  A
+    checker can be given its own with the max_complexity keyword instead,
+    and checkers share no other state, so they can run in many threads at
+    once.  If a Profile is given, the checker reports its timings to it.
+
+    With early_exit, the rest of a function is skipped once it is over the
+    threshold, and it is only reported as more complex than that.  With
+    fail_fast, a file is not checked any further after its first error.
+    With a Baseline, functions no more complex than it records are not
+    reported; they are always walked in full to be compared with it.
+    """
     name = 'mccabe'
     version = __version__
     _code = 'C901'
     _error_tmpl = "C901 %r is too complex (%d)"
+    _early_error_tmpl = "C901 %r is too complex (> %d)"
     max_complexity = -1
+    early_exit = False
+    fail_fast = False
+    baseline = None
+    profile = None
 
-    def __init__(self, tree, filename):
+    def __init__(self, tree, filename, *, max_complexity=None, profile=None,
+                 early_exit=None, fail_fast=None, baseline=None):
         self.tree = tree
+        self.filename = filename
+        if max_complexity is not None:
+            self.max_complexity = max_complexity
+        if profile is not None:
+            self.profile = profile
+        if early_exit is not None:
+            self.early_exit = early_exit
+        if fail_fast is not None:
+            self.fail_fast = fail_fast
+        if baseline is not None:
+            self.baseline = baseline
 
     @classmethod
     def add_options(cls, parser):
-        flag = '--max-complexity'
-        kwargs = {
-            'default': -1,
-            'action': 'store',
-            'type': int,
-            'help': 'McCabe complexity threshold',
-            'parse_from_config': 'True',
-        }
+        cls._add_option(parser, '--max-complexity', default=-1,
+                        action='store', type=int,
+                        help='McCabe complexity threshold')
+        cls._add_option(parser, '--max-complexity-early-exit', default=False,
+                        action='store_true',
+                        help='stop computing the complexity of a function '
+                             'once it is over the threshold')
+        cls._add_option(parser, '--max-complexity-fail-fast', default=False,
+                        action='store_true',
+                        help='stop checking a file at its first function '
+                             'over the McCabe complexity threshold')
+        cls._add_option(parser, '--max-complexity-baseline', default=None,
+                        action='store', metavar='FILE',
+                        help='only report the functions that are not in this '
+                             'baseline, written by "python -m mccabe '
+                             '--write-baseline", or are more complex than it '
+                             'records')
+
+    @staticmethod
+    def _add_option(parser, flag, **kwargs):
         config_opts = getattr(parser, 'config_options', None)
         if isinstance(config_opts, list):
             # Flake8 2.x
-            kwargs.pop('parse_from_config')
             parser.add_option(flag, **kwargs)
-            parser.config_options.append('max-complexity')
+            parser.config_options.append(flag[2:])
         else:
-            parser.add_option(flag, **kwargs)
+            parser.add_option(flag, parse_from_config='True', **kwargs)
 
     @classmethod
     def parse_options(cls, options):
         cls.max_complexity = int(options.max_complexity)
+        cls.early_exit = getattr(options, 'max_complexity_early_exit', False)
+        cls.fail_fast = getattr(options, 'max_complexity_fail_fast', False)
+        baseline = getattr(options, 'max_complexity_baseline', None)
+        try:
+            cls.baseline = Baseline(baseline) if baseline else None
+        except (OSError, ValueError) as e:
+            # Fail like an invalid option rather than with a traceback.
+            sys.stderr.write("flake8: error: argument "
+                             "--max-complexity-baseline: %s\n" % e)
+            sys.exit(2)
 
     def run(self):
         if self.max_complexity < 0:
             return
-        visitor = PathGraphingAstVisitor()
-        visitor.preorder(self.tree, visitor)
-        for graph in visitor.graphs.values():
-            if graph.complexity() > self.max_complexity:
-                text = self._error_tmpl % (graph.entity, graph.complexity())
+        early_exit = self.early_exit and self.baseline is None
+        limit = self.max_complexity if early_exit else None
+        if self.profile is None:
+            graphs = ((graph, graph.complexity())
+                      for graph in iter_graphs(self.tree, limit=limit))
+        else:
+            graphs = _profiled_graphs(self.tree, self.filename, self.profile,
+                                      limit=limit)
+        for graph, complexity in graphs:
+            if complexity > self.max_complexity and not self._allowed(
+                    graph, complexity):
+                if early_exit:
+                    text = self._early_error_tmpl % (graph.entity,
+                                                     self.max_complexity)
+                else:
+                    text = self._error_tmpl % (graph.entity, complexity)
                 yield graph.lineno, graph.column, text, type(self)
+                if self.fail_fast:
+                    return
+
+    def _allowed(self, graph, complexity):
+        return self.baseline is not None and self.baseline.allows(
+            self.filename, graph.entity, complexity)
+
+
+ComplexityRecord = namedtuple(
+    'ComplexityRecord', 'filename entity lineno column complexity name')
+ComplexityRecord.__doc__ = """The complexity of one function or module-level
+block.  `name` is the label the command line tool prints for it."""
+
+
+def _tree_records(tree, filename, profile=None, parse=0.0):
+    if profile is None:
+        graphs = ((graph, graph.complexity()) for graph in iter_graphs(tree))
+    else:
+        graphs = _profiled_graphs(tree, filename, profile, parse)
+    for graph, complexity in graphs:
+        yield ComplexityRecord(filename, graph.entity, graph.lineno,
+                               graph.column, complexity, graph.name)
+
+
+def _parse(code, filename):
+    """Return code as a tree, parsing it unless it already is one"""
+    if isinstance(code, ast.AST):
+        return code
+    return compile(code, filename, "exec", ast.PyCF_ONLY_AST)
+
+
+def iter_code_complexity(code, filename='stdin', profile=None):
+    """Return an iterator of ComplexityRecords for the graphs in code, a
+    string, source bytes or an already parsed ast.Module.  If a Profile is
+    given, the timings are reported to it.
+
+    Raises SyntaxError if code cannot be parsed.
+    """
+    if profile is None:
+        return _tree_records(_parse(code, filename), filename)
+    started = time.perf_counter()
+    tree = _parse(code, filename)
+    return _tree_records(tree, filename, profile,
+                         time.perf_counter() - started)
+
+
+def _module_records(module, threshold=1):
+    filename, code = module
+    try:
+        records = iter_code_complexity(code, filename)
+    except SyntaxError:
+        e = sys.exc_info()[1]
+        sys.stderr.write("Unable to parse %s: %s\n" % (filename, e))
+        return []
+    return [record for record in records if record.complexity >= threshold]
+
+
+def iter_modules_complexity(modules, threshold=1, threads=1):
+    """Yield ComplexityRecords reaching threshold for the graphs in each
+    (filename, code) pair, where code is anything iter_code_complexity
+    accepts.
+
+    With threads > 1 the modules are analyzed in a pool of that many
+    threads, a few modules per thread ahead of the caller, and the records
+    are still yielded in order.  Modules that cannot be parsed are
+    reported on stderr and skipped.
+    """
+    analyze = functools.partial(_module_records, threshold=threshold)
+    if threads == 1:
+        results = map(analyze, modules)
+    else:
+        results = _map_threads(analyze, modules, threads)
+    for records in results:
+        for record in records:
+            yield record
+
+
+def _map_threads(func, items, threads):
+    """Yield func(item) for each item in order, using a pool of threads and
+    taking only a few items per thread ahead of the caller.
+
+    Items not yet started are cancelled if the caller stops early.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        try:
+            for item in items:
+                pending.append(executor.submit(func, item))
+                if len(pending) > 4 * threads:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def _submit(fetch, pending, submit):
+    """Submit the module fetched by the finished task fetch, and return
+    whether the source may have more.
+    """
+    try:
+        module = fetch.result()
+    except StopAsyncIteration:
+        return False
+    pending.add(submit(module))
+    return True
+
+
+async def aiter_modules_complexity(modules, threshold=1, concurrency=8,
+                                   executor=None):
+    """Asynchronously yield ComplexityRecords reaching threshold for each
+    (filename, code) pair from the async iterable modules.
+
+    The parsing and visiting run in executor (the event loop's default
+    one if None), with at most `concurrency` modules in flight.  The next
+    module is awaited alongside the ones in flight, so records are yielded
+    as soon as their modules finish, even while the source is slow, and no
+    more modules are taken while the caller is not consuming them.
+    Modules that cannot be parsed are reported on stderr and skipped.
+    """
+    import asyncio
+    loop = asyncio.get_event_loop()
+    analyze = functools.partial(_module_records, threshold=threshold)
+    submit = functools.partial(loop.run_in_executor, executor, analyze)
+    modules = modules.__aiter__()
+    pending = set()
+    fetch = None
+    more = True
+    try:
+        while more or pending:
+            if more and fetch is None and len(pending) < concurrency:
+                fetch = asyncio.ensure_future(modules.__anext__())
+                pending.add(fetch)
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED)
+            if fetch in done:
+                done.remove(fetch)
+                more = _submit(fetch, pending, submit)
+                fetch = None
+            for future in done:
+                for record in future.result():
+                    yield record
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def iter_complexity(filenames, cache=None):
+    """Yield ComplexityRecords for the graphs in each of the files, reading
+    one file at a time.
+
+    Files that cannot be parsed are reported on stderr and skipped.  If a
+    ResultCache is given, unchanged files are read from it.
+    """
+    for filename in filenames:
+        try:
+            records = _file_records(filename, cache)
+        except _FILE_ERRORS:
+            sys.stderr.write(_file_error(filename, sys.exc_info()[1]))
+            continue
+        for record in records:
+            yield record
+
+
+def iter_archive_complexity(archives, threshold=1):
+    """Yield ComplexityRecords reaching threshold for the graphs in each
+    *.py file of the zip (wheel, egg) and tar (sdist) archives.
+
+    Members are read one at a time, straight out of each archive, and
+    decoded like files.  The filename of a record is the member's path
+    below its archive, e.g. ``dist/pkg-1.0-py3-none-any.whl/pkg/mod.py``.
+    Members that cannot be parsed are reported on stderr and skipped.
+    """
+    for archive in archives:
+        modules = ((filename, _source(data))
+                   for filename, data in _iter_archive_members(archive))
+        for record in iter_modules_complexity(modules, threshold):
+            yield record
+
+
+# The statements the visitors have visit methods of their own for, by the
+# kind of graph they make, named after those methods.  _mccabe_speedups
+# counts graphs from this table too.
+_STATEMENT_KINDS = {
+    ast.FunctionDef: "Function", ast.AsyncFunctionDef: "Function",
+    ast.If: "If", ast.For: "Loop", ast.AsyncFor: "Loop", ast.While: "Loop",
+    ast.Try: "TryExcept", ast.ClassDef: "Class", ast.With: "With",
+    ast.AsyncWith: "With",
+}
+# Statements whose bodies are visited as if they were at the level of the
+# statement itself, and those that make a path graph of their own when
+# they are not inside a function.
+_BLOCK_STATEMENTS = tuple(klass for klass, kind in _STATEMENT_KINDS.items()
+                          if kind in ("Class", "With"))
+_GRAPH_STATEMENTS = tuple(klass for klass in _STATEMENT_KINDS
+                          if klass not in _BLOCK_STATEMENTS)
+
+
+def _statement_ends(body, end):
+    """Yield (node, end line) for each statement in a body ending at end"""
+    for i, node in enumerate(body):
+        node_end = getattr(node, 'end_lineno', None)
+        if node_end is None:
+            # Python < 3.8: a statement ends where the next one starts
+            node_end = body[i + 1].lineno - 1 if i + 1 < len(body) else end
+        yield node, node_end
+
+
+def _iter_graph_statements(body, classname, end):
+    """Yield (node, classname, end line) for each statement in body, and in
+    the classes and with blocks in it, that makes a graph of its own.
+    """
+    for node, node_end in _statement_ends(body, end):
+        if isinstance(node, _GRAPH_STATEMENTS):
+            yield node, classname, node_end
+        elif isinstance(node, _BLOCK_STATEMENTS):
+            inner = classname
+            if isinstance(node, ast.ClassDef):
+                inner += node.name + "."
+            for unit in _iter_graph_statements(node.body, inner, node_end):
+                yield unit
+
+
+def iter_graphs(tree, visitor=None, limit=None):
+    """Yield the graph of each function and module-level block in a module's
+    tree as soon as visitor has finished it, without keeping it.
+
+    Peak memory is then bounded by the largest graph rather than by the
+    whole module.  A function that is redefined later under the same name
+    is skipped, as the later one replaces it in visitor.graphs too.  If
+    visitor is None, the graphs are PathCounts, counted by the
+    _mccabe_speedups accelerator if it is installed and by a new
+    PathCountingAstVisitor otherwise, and counting stops once a graph's
+    complexity is over limit, if one is given.
+    """
+    statements = _latest_graph_statements(tree)
+    if visitor is None:
+        speedups = _speedups()
+        if speedups is not None:
+            return (_counted_graph(node, classname,
+                                   speedups.graph_size(node, limit))
+                    for node, classname in statements)
+        visitor = PathCountingAstVisitor(limit)
+    return _visited_graphs(statements, visitor)
+
+
+def _latest_graph_statements(tree):
+    """Yield (node, classname) for the statements that make graphs, leaving
+    out functions redefined later under the same name.
+    """
+    functions = (ast.FunctionDef, ast.AsyncFunctionDef)
+    statements = list(_iter_graph_statements(tree.body, "", 0))
+    latest = dict((classname + node.name, node)
+                  for node, classname, _ in statements
+                  if isinstance(node, functions))
+    for node, classname, _ in statements:
+        if (not isinstance(node, functions) or
+                latest[classname + node.name] is node):
+            yield node, classname
+
+
+def _visited_graphs(statements, visitor):
+    for node, classname in statements:
+        visitor.classname = classname
+        visitor.iterative_preorder(node, visitor)
+        for graph in visitor.graphs.values():
+            yield graph
+        visitor.graphs.clear()
+    visitor.classname = ""
+
+
+@functools.lru_cache(maxsize=None)
+def _speedups():
+    """Return the _mccabe_speedups module, or None if it is not installed"""
+    try:
+        import _mccabe_speedups
+    except ImportError:
+        return None
+    return _mccabe_speedups
+
+
+def _counted_graph(node, classname, size):
+    """Return the PathCount a PathCountingAstVisitor makes for node, given
+    its (nodes, edges).
+    """
+    kind = _STATEMENT_KINDS[node.__class__]
+    if kind == "Function":
+        entity = classname + node.name
+        name = '%d:%d: %r' % (node.lineno, node.col_offset, entity)
+    else:
+        name = entity = "%s %d" % (kind, node.lineno)
+    graph = PathCount(name, entity, node.lineno, node.col_offset)
+    graph.nodes, graph.edges = size
+    return graph
+
+
+class IncrementalAnalyzer(object):
+    """Analyzes successive versions of a file, visiting only the functions
+    and module-level blocks whose source changed since the last version.
+
+    The results of each function or block are kept under the hash of its
+    source lines, so one that only moved is not visited again.  Each call
+    to :meth:`update` still parses the whole file to find those lines.
+    """
+
+    def __init__(self, filename='stdin'):
+        self.filename = filename
+        self.recomputed = 0
+        self._units = {}
+
+    def update(self, code):
+        """Return the ComplexityRecords for this version of the file.
+
+        Raises SyntaxError if code cannot be parsed.
+        """
+        import hashlib
+        tree = compile(code, self.filename, "exec", ast.PyCF_ONLY_AST)
+        # Only the line breaks the tokenizer knows, unlike str.splitlines()
+        lines = io.StringIO(code, newline=None).readlines()
+        units = {}
+        graphs = {}
+        self.recomputed = 0
+        for node, classname, end in _iter_graph_statements(
+                tree.body, "", len(lines)):
+            text = "".join(lines[node.lineno - 1:end])
+            key = (classname,
+                   hashlib.sha1(text.encode('utf-8', 'replace')).digest())
+            unit = self._units.get(key)
+            if unit is None:
+                unit = self._analyze(node, classname)
+                self.recomputed += 1
+            units[key] = unit
+            graph_key, record = self._moved(unit, node.lineno, classname)
+            graphs[graph_key] = record
+        self._units = units
+        return list(graphs.values())
+
+    def _analyze(self, node, classname):
+        visitor = PathCountingAstVisitor()
+        visitor.classname = classname
+        visitor.iterative_preorder(node, visitor)
+        (key, graph), = visitor.graphs.items()
+        return key, ComplexityRecord(self.filename, graph.entity,
+                                     graph.lineno, graph.column,
+                                     graph.complexity(), graph.name)
+
+    @staticmethod
+    def _moved(unit, lineno, classname):
+        """Return the graph key and record of unit once moved to lineno"""
+        key, record = unit
+        if record.lineno == lineno:
+            return key, record
+        if record.name == record.entity:
+            # A module-level block, named after its kind and line
+            name = "%s %d" % (record.name.rsplit(" ", 1)[0], lineno)
+            return classname + name, record._replace(
+                entity=name, lineno=lineno, name=name)
+        name = '%d:%d: %r' % (lineno, record.column, record.entity)
+        return key, record._replace(lineno=lineno, name=name)
+
+
+class _Components(object):
+    """The strongly connected components of a graph given as a dict of
+    node -> successors, found by Tarjan's algorithm without recursion.
+
+    `components` lists each component after every component it reaches.
+    """
+
+    def __init__(self, graph):
+        self.graph = graph
+        self.index = {}
+        self.low = {}
+        self.stack = []
+        self.on_stack = set()
+        self.components = []
+        for node in graph:
+            if node not in self.index:
+                self._search(node)
+
+    def _push(self, node, work):
+        self.index[node] = self.low[node] = len(self.index)
+        self.stack.append(node)
+        self.on_stack.add(node)
+        work.append((node, iter(self.graph[node])))
+
+    def _next_new(self, node, successors):
+        """Return the next successor not searched yet, or None, lowering
+        the link of node to the successors still on the stack.
+        """
+        for successor in successors:
+            if successor not in self.index:
+                return successor
+            if successor in self.on_stack:
+                self.low[node] = min(self.low[node], self.index[successor])
+        return None
+
+    def _search(self, root):
+        work = []
+        self._push(root, work)
+        while work:
+            node, successors = work[-1]
+            successor = self._next_new(node, successors)
+            if successor is not None:
+                self._push(successor, work)
+                continue
+            work.pop()
+            if work:
+                parent = work[-1][0]
+                self.low[parent] = min(self.low[parent], self.low[node])
+            if self.low[node] == self.index[node]:
+                self._pop_component(node)
+
+    def _pop_component(self, node):
+        component = []
+        while not component or component[-1] != node:
+            member = self.stack.pop()
+            self.on_stack.discard(member)
+            component.append(member)
+        self.components.append(component)
+
+
+def _dotted_name(expr):
+    """Return the names in a dotted expression like a.b.c, or None"""
+    parts = []
+    while isinstance(expr, ast.Attribute):
+        parts.append(expr.attr)
+        expr = expr.value
+    if not isinstance(expr, ast.Name):
+        return None
+    parts.append(expr.id)
+    return parts[::-1]
+
+
+def _import_base(node, package):
+    """Return the module a from-import imports from"""
+    if not node.level:
+        return node.module
+    parts = package.split('.') if package else []
+    if node.level > 1:
+        parts = parts[:1 - node.level]
+    if node.module:
+        parts.append(node.module)
+    return '.'.join(parts)
+
+
+def _imported_names(tree, package):
+    """Map each name imported anywhere in a module to what it refers to"""
+    names = {}
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                name = alias.asname or alias.name.split('.')[0]
+                names[name] = alias.name if alias.asname else name
+        elif isinstance(node, ast.ImportFrom):
+            base = _import_base(node, package)
+            for alias in node.names:
+                names[alias.asname or alias.name] = '.'.join(
+                    part for part in (base, alias.name) if part)
+    return names
+
+
+def _call_names(node, module, classname, imports):
+    """Yield the full dotted name of what each call in node calls"""
+    for call in ast.walk(node):
+        if not isinstance(call, ast.Call):
+            continue
+        parts = _dotted_name(call.func)
+        if not parts:
+            continue
+        if parts[0] in imports:
+            # Already a full name
+            yield '.'.join([imports[parts[0]]] + parts[1:])
+            continue
+        if parts[0] in ('self', 'cls') and classname:
+            parts[0] = classname[:-1]
+        yield '.'.join([module] + parts if module else parts)
+
+
+class CallGraph(object):
+    """The functions of one or more modules and the calls between them.
+
+    Calls to functions and methods of the modules added are resolved by
+    name: plain names, imported names and modules, ``self.`` and ``cls.``
+    in methods, and classes (as calls to their ``__init__``).
+    :meth:`transitive_complexity` scores each function with the
+    complexity of every function it can reach, each counted once.
+    Recursive calls are grouped in linear time, and the result for each
+    group of functions is computed once and shared by its callers.
+    """
+
+    def __init__(self):
+        self.records = {}
+        self._names = {}
+        self._totals = None
+
+    def add_module(self, code, module='', filename='stdin',
+                   is_package=False):
+        """Add the functions in code (anything iter_code_complexity accepts)
+        as those of the module with dotted name module.
+
+        Raises SyntaxError if code cannot be parsed.
+        """
+        tree = _parse(code, filename)
+        package = module if is_package else module.rpartition('.')[0]
+        imports = _imported_names(tree, package)
+        graphs = dict(((graph.lineno, graph.column), graph)
+                      for graph in iter_graphs(tree))
+        for node, classname, _ in _iter_graph_statements(tree.body, "", 0):
+            graph = graphs.get((node.lineno, node.col_offset))
+            if graph is None:
+                # Replaced by a later definition
+                continue
+            key = (module, graph.entity)
+            self.records[key] = ComplexityRecord(
+                filename, graph.entity, graph.lineno, graph.column,
+                graph.complexity(), graph.name)
+            self._names[key] = set(_call_names(node, module, classname,
+                                               imports))
+        self._totals = None
+
+    def _resolve(self, name):
+        """Return the key of the function a dotted name refers to, or None"""
+        parts = name.split('.')
+        for i in range(len(parts)):
+            module, entity = '.'.join(parts[:i]), '.'.join(parts[i:])
+            for key in ((module, entity), (module, entity + '.__init__')):
+                if key in self.records:
+                    return key
+        return None
+
+    def calls(self):
+        """Return a dict of each function's key -> the keys it calls"""
+        calls = {}
+        for key, names in self._names.items():
+            resolved = (self._resolve(name) for name in names)
+            calls[key] = set(callee for callee in resolved if callee)
+        return calls
+
+    def transitive_complexity(self):
+        """Return a dict of each function's (module, entity) key -> the sum
+        of the complexities of it and all the functions it can reach.
+        """
+        if self._totals is not None:
+            return self._totals
+        calls = self.calls()
+        component_of = {}
+        reached = []
+        self._totals = {}
+        for i, component in enumerate(_Components(calls).components):
+            reach = set(component)
+            for key in component:
+                component_of[key] = i
+            for callee in set().union(*[calls[key] for key in component]):
+                if component_of[callee] != i:
+                    reach |= reached[component_of[callee]]
+            reached.append(reach)
+            total = sum(self.records[key].complexity for key in reach)
+            for key in component:
+                self._totals[key] = total
+        return self._totals
+
+    def iter_records(self):
+        """Yield the ComplexityRecord of each function with its transitive
+        complexity.
+        """
+        totals = self.transitive_complexity()
+        for key, record in self.records.items():
+            yield record._replace(complexity=totals[key])
+
+
+_HUNK_PATTERN = r'^@@ -\d+(?:,(\d+))? \+(\d+)(?:,(\d+))? @@'
+
+
+def _diff_filename(header):
+    """Return the file named by the +++ header of a diff, or None"""
+    filename = header.split('\t', 1)[0].rstrip('\r\n')
+    if filename == '/dev/null':
+        return None
+    if filename.startswith('b/'):
+        filename = filename[2:]
+    return filename
+
+
+def _line_ranges(lines):
+    """Return sorted, disjoint (start, end) ranges covering lines"""
+    ranges = []
+    for line in sorted(lines):
+        if ranges and ranges[-1][1] + 1 >= line:
+            ranges[-1][1] = line
+        else:
+            ranges.append([line, line])
+    return [tuple(r) for r in ranges]
+
+
+def _hunk_lines(header, diff_lines):
+    """Return the lines changed by the hunk that starts with header, taking
+    the rest of the hunk from the diff_lines iterator.
+    """
+    import re
+    old_count, start, new_count = re.match(_HUNK_PATTERN, header).groups()
+    old_left = int(old_count or 1)
+    new_left = int(new_count or 1)
+    # A hunk that only removes lines starts after the given line.
+    lineno = int(start) + (new_left == 0)
+    lines = set()
+    removed = False
+    while old_left > 0 or new_left > 0:
+        tag = next(diff_lines, ' ')[:1]
+        if tag == '+':
+            lines.add(lineno)
+            lineno += 1
+            new_left -= 1
+            removed = False
+        elif tag == '-':
+            old_left -= 1
+            removed = True
+        elif tag != '\\':
+            if removed:
+                # Lines removed without replacement mark either side.
+                lines.update((lineno - 1, lineno))
+                removed = False
+            lineno += 1
+            old_left -= 1
+            new_left -= 1
+    if removed:
+        lines.update((lineno - 1, lineno))
+    return lines
+
+
+def parse_diff(diff):
+    """Return {filename: line ranges} for the lines a unified diff changes.
+
+    The line ranges are sorted, disjoint (start, end) pairs in the new
+    version of each file.  Added lines are included, and lines removed
+    without replacement mark the lines on either side of where they were.
+    """
+    changed = {}
+    lines = None
+    diff_lines = iter(diff.splitlines())
+    for line in diff_lines:
+        if line.startswith('+++ '):
+            lines = changed.setdefault(_diff_filename(line[4:]), set())
+        elif line.startswith('@@') and lines is not None:
+            lines.update(_hunk_lines(line, diff_lines))
+    changed.pop(None, None)
+    return dict((filename, _line_ranges(lines))
+                for filename, lines in changed.items())
+
+
+def git_changes(rev_range):
+    """Return parse_diff() of `git diff rev_range` in the current directory.
+
+    The files are read from the working tree, so rev_range should end at
+    the checked out commit, or be a single revision to compare the working
+    tree with.
+    """
+    import subprocess
+    diff = subprocess.check_output(
+        ['git', 'diff', '--no-color', '--no-ext-diff', '--relative', '-U0',
+         rev_range, '--'])
+    return parse_diff(diff.decode('utf-8', 'surrogateescape'))
+
+
+def _touches(ranges, starts, first, last):
+    """Whether any of the sorted, disjoint ranges overlaps first..last"""
+    import bisect
+    i = bisect.bisect_right(starts, last) - 1
+    return i >= 0 and ranges[i][1] >= first
+
+
+def _changed_graph_starts(tree, ranges, end):
+    """Return the (lineno, column) of each graph in tree whose statement
+    overlaps any of the line ranges.
+    """
+    starts = [start for start, _ in ranges]
+    changed = set()
+    for node, _, node_end in _iter_graph_statements(tree.body, "", end):
+        first = min([node.lineno] + [decorator.lineno for decorator in
+                                     getattr(node, 'decorator_list', ())])
+        if _touches(ranges, starts, first, node_end):
+            changed.add((node.lineno, node.col_offset))
+    return changed
+
+
+def iter_changed_complexity(changes):
+    """Yield ComplexityRecords for the functions and module-level blocks
+    that overlap the changed lines, given as returned by parse_diff().
+
+    Only the changed Python files are read.  Files that cannot be parsed
+    are reported on stderr and skipped.
+    """
+    for filename in sorted(changes):
+        if not filename.endswith('.py'):
+            continue
+        try:
+            records = _changed_results(filename, changes[filename])
+        except _FILE_ERRORS:
+            sys.stderr.write(_file_error(filename, sys.exc_info()[1]))
+            continue
+        for record in records:
+            yield record
+
+
+def _changed_results(filename, ranges, dot=False, profile=None):
+    """Return the PathGraphs (for dot) or ComplexityRecords of a file that
+    overlap the line ranges.
+    """
+    data = _read_bytes(filename)
+    tree = compile(_source(data), filename, "exec", ast.PyCF_ONLY_AST)
+    if dot:
+        results = iter_graphs(tree, PathGraphingAstVisitor(ArrayPathGraph))
+    else:
+        results = _tree_records(tree, filename, profile)
+    starts = _changed_graph_starts(tree, ranges, data.count(b'\n') + 1)
+    return [result for result in results
+            if (result.lineno, result.column) in starts]
 
 
 def get_code_complexity(code, threshold=7, filename='stdin'):
     try:
-        tree = compile(code, filename, "exec", ast.PyCF_ONLY_AST)
+        records = iter_code_complexity(code, filename)
     except SyntaxError:
         e = sys.exc_info()[1]
         sys.stderr.write("Unable to parse %s: %s\n" % (filename, e))
         return 0
 
     complx = []
-    McCabeChecker.max_complexity = threshold
-    for lineno, offset, text, check in McCabeChecker(tree, filename).run():
-        complx.append('%s:%d:1: %s' % (filename, lineno, text))
+    for record in records:
+        if record.complexity > threshold:
+            text = McCabeChecker._error_tmpl % (record.entity,
+                                                record.complexity)
+            complx.append('%s:%d:1: %s' % (filename, record.lineno, text))
 
     if len(complx) == 0:
         return 0
@@ -291,58 +1665,847 @@ def get_code_complexity(code, threshold=7, filename='stdin'):
 
 def get_module_complexity(module_path, threshold=7):
     """Returns the complexity of a module"""
-    code = _read(module_path)
+    code = _source(_read_bytes(module_path))
     return get_code_complexity(code, threshold, filename=module_path)
 
 
+def _read_bytes(filename):
+    """Read a file in a single open() call."""
+    with open(filename, 'rb') as f:
+        return f.read()
+
+
+def _iter_archive_members(archive):
+    """Yield (filename, source bytes) for each *.py file in a zip or tar
+    archive, without extracting it.
+    """
+    import zipfile
+    if zipfile.is_zipfile(archive):
+        with zipfile.ZipFile(archive) as z:
+            for info in z.infolist():
+                if info.filename.endswith('.py') and not info.is_dir():
+                    yield os.path.join(archive, info.filename), z.read(info)
+        return
+    import tarfile
+    # A stream never seeks back, so compressed tars are only read once.
+    with tarfile.open(archive, 'r|*') as tar:
+        for member in tar:
+            if member.name.endswith('.py') and member.isfile():
+                data = tar.extractfile(member).read()
+                yield os.path.join(archive, member.name), data
+
+
+def _encoding(data):
+    """Return the encoding source bytes declare, or None if it is improperly
+    declared.
+    """
+    import tokenize
+    try:
+        encoding, _ = tokenize.detect_encoding(io.BytesIO(data).readline)
+    except (LookupError, SyntaxError, UnicodeError):
+        return None
+    return encoding
+
+
+def _source(data):
+    """Return source bytes in a form compile() accepts.
+
+    compile() decodes bytes itself when their encoding is declared
+    properly, so they are only decoded here for the latin-1 fallback.
+    """
+    if _encoding(data) is None:
+        return data.decode('latin-1')
+    return data
+
+
 def _read(filename):
-    if (2, 5) < sys.version_info < (3, 0):
-        with open(filename, 'rU') as f:
-            return f.read()
-    elif (3, 0) <= sys.version_info < (4, 0):
-        """Read the source code."""
+    """Read the source code."""
+    data = _read_bytes(filename)
+    # Fall back if file encoding is improperly declared
+    text = data.decode(_encoding(data) or 'latin-1')
+    if '\r' in text:
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+    return text
+
+
+# Errors reading or parsing a file that skip the file instead of ending the
+# run: a missing or unreadable file, undecodable source, or a syntax error.
+_FILE_ERRORS = (OSError, SyntaxError, UnicodeError)
+
+
+def _file_error(filename, e):
+    """Return the message for a file that could not be read or parsed"""
+    if isinstance(e, SyntaxError):
+        return "Unable to parse %s: %s\n" % (filename, e)
+    return "Unable to read %s: %s\n" % (filename, e)
+
+
+class ResultCache(object):
+    """An on-disk store of per-file complexity results.
+
+    Each entry is a small JSON file named after the hash of a file's
+    contents, the mccabe version and the Python version, so an entry is
+    never reused for a file that changed or by a different mccabe or
+    Python.  Entries are written to a temporary file and renamed into
+    place, so concurrent writers never expose a partial entry, and
+    :meth:`evict` trims the least recently used entries once the cache
+    grows past `max_size` bytes.
+    """
+
+    def __init__(self, directory, max_size=64 * 1024 * 1024):
+        self.directory = directory
+        self.max_size = max_size
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def key(self, data):
+        """Return the cache key for the contents of a file"""
+        import hashlib
+        digest = hashlib.sha256()
+        digest.update(('mccabe %s\npython %s\n' % (
+            __version__, sys.version)).encode('utf-8'))
+        digest.update(data)
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.json')
+
+    def get(self, key):
+        """Return the results stored under key, or None"""
+        import json
+        path = self._path(key)
         try:
-            with open(filename, 'rb') as f:
-                (encoding, _) = tokenize.detect_encoding(f.readline)
-        except (LookupError, SyntaxError, UnicodeError):
-            # Fall back if file encoding is improperly declared
-            with open(filename, encoding='latin-1') as f:
-                return f.read()
-        with open(filename, 'r', encoding=encoding) as f:
-            return f.read()
+            with open(path) as f:
+                results = json.load(f)
+            # Record the hit for evict()
+            os.utime(path, None)
+        except (OSError, ValueError):
+            return None
+        return [tuple(result) for result in results]
 
+    def set(self, key, results):
+        """Store results under key"""
+        import json
+        import tempfile
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(results, f)
+            os.replace(tmp_path, self._path(key))
+        except OSError:
+            os.unlink(tmp_path)
+            raise
 
-def main(argv=None):
-    if argv is None:
-        argv = sys.argv[1:]
-    opar = optparse.OptionParser()
-    opar.add_option("-d", "--dot", dest="dot",
-                    help="output a graphviz dot file", action="store_true")
+    def _entries(self):
+        """Return (mtime, size, path) for each entry"""
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                # Evicted by a concurrent run
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def evict(self):
+        """Remove the least recently used entries beyond max_size"""
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            total -= size
+
+
+class MemoryCache(object):
+    """An in-memory store of per-file complexity results, for the server.
+
+    It is used the same way as ResultCache, and :meth:`evict` keeps the
+    `max_entries` most recently used entries.
+    """
+
+    def __init__(self, max_entries=100000):
+        self.max_entries = max_entries
+        self._results = OrderedDict()
+
+    def key(self, data):
+        """Return the cache key for the contents of a file"""
+        import hashlib
+        return hashlib.sha256(data).hexdigest()
+
+    def get(self, key):
+        """Return the results stored under key, or None"""
+        results = self._results.get(key)
+        if results is not None:
+            self._results.move_to_end(key)
+        return results
+
+    def set(self, key, results):
+        """Store results under key"""
+        self._results[key] = results
+        self._results.move_to_end(key)
+
+    def evict(self):
+        """Remove the least recently used entries beyond max_entries"""
+        while len(self._results) > self.max_entries:
+            self._results.popitem(last=False)
+
+
+class Baseline(object):
+    """The complexity of each function of a code base at some point, so
+    that only the functions that are new or more complex since then are
+    reported.
+
+    The file is an open addressing hash table of a 64-bit hash of each
+    function's file and entity and its complexity.  It is mapped into
+    memory rather than read, so opening a baseline and looking a function
+    up take the same time however many functions it holds.
+    """
+
+    _MAGIC = b'mccabe-baseline\n'
+    _HEADER = '<16sI'  # magic, number of slots
+    _SLOT = '<QI'  # key, complexity; a key of 0 marks an empty slot
+
+    def __init__(self, filename):
+        import mmap
+        import struct
+        with open(filename, 'rb') as f:
+            if os.fstat(f.fileno()).st_size < struct.calcsize(self._HEADER):
+                raise ValueError("%s is not a mccabe baseline" % filename)
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self._slots = struct.unpack_from(self._HEADER, self._data)
+        if magic != self._MAGIC:
+            self._data.close()
+            raise ValueError("%s is not a mccabe baseline" % filename)
+        self._offset = struct.calcsize(self._HEADER)
+        self._unpack = struct.Struct(self._SLOT).unpack_from
+        self._size = struct.calcsize(self._SLOT)
+
+    @staticmethod
+    def _key(filename, entity):
+        import hashlib
+        if os.path.isabs(filename):
+            path = os.path.relpath(filename)
+        else:
+            path = os.path.normpath(filename)
+        path = path.replace(os.sep, '/')
+        digest = hashlib.blake2b(('%s\0%s' % (path, entity)).encode('utf-8'),
+                                 digest_size=8).digest()
+        return int.from_bytes(digest, 'little') or 1
+
+    def get(self, filename, entity):
+        """Return the complexity recorded for a function, or None"""
+        key = self._key(filename, entity)
+        slot = key % self._slots
+        while True:
+            found, complexity = self._unpack(
+                self._data, self._offset + slot * self._size)
+            if found == key:
+                return complexity
+            if not found:
+                return None
+            slot = (slot + 1) % self._slots
+
+    def allows(self, filename, entity, complexity):
+        """Return whether a function is no more complex than recorded"""
+        recorded = self.get(filename, entity)
+        return recorded is not None and complexity <= recorded
+
+    def close(self):
+        self._data.close()
+
+    @classmethod
+    def write(cls, filename, records):
+        """Record the complexity of each (filename, entity, complexity) or
+        ComplexityRecord in a new baseline file, and return their number.
+        """
+        import struct
+        entries = {}
+        for record in records:
+            if isinstance(record, ComplexityRecord):
+                record = record.filename, record.entity, record.complexity
+            key = cls._key(*record[:2])
+            entries[key] = max(record[2], entries.get(key, 0))
+        # At most half full, so a lookup probes few slots.
+        slots = 2 * len(entries) + 1
+        offset, size = struct.calcsize(cls._HEADER), struct.calcsize(cls._SLOT)
+        table = bytearray(offset + slots * size)
+        struct.pack_into(cls._HEADER, table, 0, cls._MAGIC, slots)
+        for key in sorted(entries):
+            slot = key % slots
+            while struct.unpack_from(cls._SLOT, table, offset + slot * size)[0]:
+                slot = (slot + 1) % slots
+            struct.pack_into(cls._SLOT, table, offset + slot * size, key,
+                             entries[key])
+        # Replace the file at once, as checkers may have it mapped.
+        tmp_path = filename + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(table)
+        os.replace(tmp_path, filename)
+        return len(entries)
+
+
+def _iter_python_files(paths):
+    """Yield each path, with directories expanded to the *.py files in them"""
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames[:] = sorted(d for d in dirnames
+                                 if not d.startswith('.') and
+                                 d != '__pycache__')
+            for filename in sorted(filenames):
+                if filename.endswith('.py'):
+                    yield os.path.join(dirpath, filename)
+
+
+def _file_records(filename, cache=None, profile=None):
+    """Return the ComplexityRecords for a file, from cache if the file is
+    unchanged since they were stored there.
+    """
+    return _data_records(_read_bytes(filename), filename, cache, profile)
+
+
+def _data_records(data, filename, cache=None, profile=None):
+    """Return the ComplexityRecords for the source bytes of a file, not
+    using the cache if they are being profiled.
+    """
+    if cache is None or profile is not None:
+        return list(iter_code_complexity(_source(data), filename, profile))
+    key = cache.key(data)
+    rows = cache.get(key)
+    if rows is None:
+        records = list(iter_code_complexity(_source(data), filename))
+        # The entry is keyed by contents alone, so leave out the filename.
+        cache.set(key, [record[1:] for record in records])
+        return records
+    return [ComplexityRecord(filename, *row) for row in rows]
+
+
+def _analyze_file(filename, dot=False, threshold=1, cache=None,
+                  changes=None, profile=None):
+    """Return (filename, results, error) for the graphs of a file that reach
+    threshold, or the reason the file could not be parsed.
+
+    The results are PathGraphs for dot output, and ComplexityRecords
+    otherwise.  If changes (as returned by parse_diff) are given, only
+    graphs overlapping the file's changed lines are returned.  Timings of
+    ComplexityRecords are reported to profile if one is given.
+    """
+    try:
+        if changes is not None:
+            results = _changed_results(filename, changes[filename], dot,
+                                       profile)
+        elif dot:
+            tree = compile(_source(_read_bytes(filename)), filename,
+                           "exec", ast.PyCF_ONLY_AST)
+            results = iter_graphs(tree,
+                                  PathGraphingAstVisitor(ArrayPathGraph))
+        else:
+            results = _file_records(filename, cache, profile)
+    except _FILE_ERRORS:
+        return filename, [], _file_error(filename, sys.exc_info()[1])
+    if dot:
+        results = [graph for graph in results
+                   if graph.complexity() >= threshold]
+    else:
+        results = [record for record in results
+                   if record.complexity >= threshold]
+    return filename, results, None
+
+
+def _archive_members(archives):
+    """Yield (filename, source bytes, error) for each *.py file in each
+    archive, and the error for each archive that cannot be read.
+    """
+    import tarfile
+    import zipfile
+    for archive in archives:
+        try:
+            for filename, data in _iter_archive_members(archive):
+                yield filename, data, None
+        except (EOFError, OSError, tarfile.TarError, zipfile.BadZipFile):
+            e = sys.exc_info()[1]
+            yield archive, b'', "Unable to read %s: %s\n" % (archive, e)
+
+
+def _analyze_member(member, threshold=1, cache=None, profile=None):
+    """Return (filename, records, error) like _analyze_file for an item of
+    _archive_members.
+    """
+    filename, data, error = member
+    if error:
+        return filename, [], error
+    try:
+        records = _data_records(data, filename, cache, profile)
+    except _FILE_ERRORS:
+        return filename, [], _file_error(filename, sys.exc_info()[1])
+    return (filename, [record for record in records
+                       if record.complexity >= threshold], None)
+
+
+def _iter_modules(paths):
+    """Yield (filename, module, is_package) for each Python file, naming the
+    modules in directories by their path below the directory.
+    """
+    for path in paths:
+        root = path if os.path.isdir(path) else os.path.dirname(path)
+        for filename in _iter_python_files([path]):
+            name = os.path.relpath(filename, root)[:-3].replace(os.sep, '.')
+            is_package = name == '__init__' or name.endswith('.__init__')
+            if is_package:
+                name = name[:-len('__init__')].rstrip('.')
+            yield filename, name, is_package
+
+
+def _transitive_results(paths, threshold=1):
+    """Yield (filename, records, error) like _analyze_file, once all of the
+    files have been read, with the transitive complexity of each function.
+    """
+    calls = CallGraph()
+    for filename, module, is_package in _iter_modules(paths):
+        try:
+            calls.add_module(_source(_read_bytes(filename)), module,
+                             filename, is_package)
+        except _FILE_ERRORS:
+            yield filename, [], _file_error(filename, sys.exc_info()[1])
+    for record in calls.iter_records():
+        if record.complexity >= threshold:
+            yield record.filename, [record], None
+
+
+def _map_files(func, filenames, jobs=1):
+    """Yield func(filename) for each file in order, using `jobs` processes
+    (or one per CPU if jobs is 0).
+    """
+    if jobs == 1:
+        for filename in filenames:
+            yield func(filename)
+        return
+    for results in _map_chunks(func, filenames, jobs or os.cpu_count() or 1):
+        for result in results:
+            yield result
+
+
+def _chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _apply(func, items):
+    return [func(item) for item in items]
+
+
+def _map_chunks(func, filenames, workers, size=8):
+    """Yield the lists of func(filename) for chunks of `size` files in
+    order, keeping only a few chunks per worker in flight so that memory
+    does not grow with the number of files.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for chunk in _chunks(filenames, size):
+            pending.append(executor.submit(_apply, func, chunk))
+            if len(pending) > 4 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _print_complexity(results, out, show_filenames=False):
+    for filename, records, error in results:
+        if error:
+            sys.stderr.write(error)
+        for record in records:
+            if show_filenames:
+                print('%s:%s' % (filename, record.name), record.complexity,
+                      file=out)
+            else:
+                print(record.name, record.complexity, file=out)
+
+
+def _print_dot(results, out):
+    writer = DotWriter(out)
+    writer.begin()
+    for filename, graphs, error in results:
+        if error:
+            sys.stderr.write(error)
+        for graph in graphs:
+            graph.write_dot(writer)
+    writer.end()
+
+
+def _print_jsonl(results, out):
+    import json
+    for filename, records, error in results:
+        if error:
+            sys.stderr.write(error)
+        for record in records:
+            out.write(json.dumps(record._asdict()) + '\n')
+
+
+_SARIF_HEADER = {
+    "$schema": "https://json.schemastore.org/sarif-2.1.0.json",
+    "version": "2.1.0",
+}
+_SARIF_DRIVER = {
+    "name": "mccabe",
+    "version": __version__,
+    "informationUri": "https://github.com/PyCQA/mccabe",
+    "rules": [{
+        "id": McCabeChecker._code,
+        "name": "complexity",
+        "shortDescription": {"text": "McCabe cyclomatic complexity"},
+    }],
+}
+
+
+def _sarif_result(record):
+    return {
+        "ruleId": McCabeChecker._code,
+        "level": "note",
+        "message": {"text": "%r has a complexity of %d" % (
+            record.entity, record.complexity)},
+        "locations": [{"physicalLocation": {
+            "artifactLocation": {"uri": record.filename.replace(os.sep, '/')},
+            "region": {"startLine": record.lineno,
+                       "startColumn": record.column + 1},
+        }}],
+        "properties": {"entity": record.entity,
+                       "complexity": record.complexity},
+    }
+
+
+def _print_sarif(results, out):
+    """Write a SARIF log, one result at a time"""
+    import json
+    header = json.dumps(_SARIF_HEADER)[:-1]
+    out.write('%s, "runs": [{"tool": {"driver": %s}, "results": [' % (
+        header, json.dumps(_SARIF_DRIVER)))
+    separator = '\n'
+    for filename, records, error in results:
+        if error:
+            sys.stderr.write(error)
+        for record in records:
+            out.write(separator + json.dumps(_sarif_result(record)))
+            separator = ',\n'
+    out.write('\n]}]}\n')
+
+
+_PRINTERS = {'dot': _print_dot, 'jsonl': _print_jsonl, 'sarif': _print_sarif}
+
+
+def _option_parser():
+    import optparse
+    opar = optparse.OptionParser(usage="%prog [options] path [path ...]")
+    opar.add_option("-f", "--format", dest="format", default="text",
+                    choices=["text", "dot", "jsonl", "sarif"],
+                    help="output format: text, dot, jsonl (one JSON record "
+                         "per line) or sarif")
+    opar.add_option("-d", "--dot", dest="format", action="store_const",
+                    const="dot", help="output a graphviz dot file, the same "
+                                      "as --format dot")
     opar.add_option("-m", "--min", dest="threshold",
                     help="minimum complexity for output", type="int",
                     default=1)
+    opar.add_option("-o", "--output", dest="output",
+                    help="write the output to this file, gzip-compressed "
+                         "if its name ends in .gz")
+    opar.add_option("-j", "--jobs", dest="jobs",
+                    help="number of processes to analyze files with, "
+                         "0 for one per CPU", type="int", default=1)
+    opar.add_option("--cache-dir", dest="cache_dir",
+                    help="directory to cache results of unchanged files in")
+    opar.add_option("--cache-size", dest="cache_size",
+                    help="maximum size of the cache in megabytes",
+                    type="int", default=64)
+    opar.add_option("--diff", dest="diff",
+                    help="only report functions changed by this unified "
+                         "diff, or - to read it from stdin")
+    opar.add_option("--git", dest="git",
+                    help="only report functions changed by this git "
+                         "revision range, e.g. main..HEAD")
+    opar.add_option("--baseline", dest="baseline", metavar="FILE",
+                    help="only report the functions that are not in this "
+                         "baseline or are more complex than it records")
+    opar.add_option("--write-baseline", dest="write_baseline",
+                    metavar="FILE",
+                    help="record the complexity of each function reaching "
+                         "--min in a new baseline instead of printing it")
+    opar.add_option("--archive", dest="archive", action="store_true",
+                    help="read the paths as zip or tar archives, such as "
+                         "wheels and sdists, and analyze the *.py files "
+                         "in them without extracting them")
+    opar.add_option("--transitive", dest="transitive", action="store_true",
+                    help="score each function with the complexity of all "
+                         "the functions it calls in the files analyzed")
+    opar.add_option("--profile", dest="profile", metavar="N", type="int",
+                    help="report timings and the N slowest files and "
+                         "functions on stderr; runs in a single process")
+    opar.add_option("--serve", dest="serve", metavar="SOCKET",
+                    help="serve requests on this Unix socket")
+    opar.add_option("--connect", dest="connect", metavar="SOCKET",
+                    help="have the server on this Unix socket do the work")
+    return opar
+
+
+def _read_changes(options):
+    """Return the changes asked for by --diff or --git, or None"""
+    if options.git:
+        return git_changes(options.git)
+    if options.diff == '-':
+        return parse_diff(sys.stdin.read())
+    if options.diff:
+        with open(options.diff) as f:
+            return parse_diff(f.read())
+    return None
 
+
+def _parse_args(argv, serving=False):
+    """Return (options, paths, changes) for the command line arguments, or
+    for the arguments a client sent if serving.
+    """
+    opar = _option_parser()
     options, args = opar.parse_args(argv)
-    if not args:
+    if not serving and (options.serve or options.connect):
+        # The server parses the rest of a client's arguments itself.
+        return options, args, None
+    _check_options(opar, options)
+    changes = _read_changes(options)
+    if changes is not None:
+        if args:
+            opar.error("paths cannot be given with --diff or --git")
+        args = sorted(f for f in changes if f.endswith('.py'))
+    elif not args:
         opar.print_help()
         opar.exit()
+    return options, args, changes
 
-    code = _read(args[0])
-    tree = compile(code, args[0], "exec", ast.PyCF_ONLY_AST)
-    visitor = PathGraphingAstVisitor()
-    visitor.preorder(tree, visitor)
 
-    if options.dot:
-        print('graph {')
-        for graph in visitor.graphs.values():
-            if (not options.threshold or
-                    graph.complexity() >= options.threshold):
-                graph.to_dot()
-        print('}')
+def _check_options(opar, options):
+    if options.jobs < 0:
+        opar.error("--jobs must not be negative")
+    if options.transitive and (
+            options.format == 'dot' or options.diff or options.git or
+            options.jobs != 1 or options.cache_dir):
+        opar.error("--transitive cannot be used with --dot, --diff, --git, "
+                   "--jobs or --cache-dir")
+    if options.archive and (options.transitive or options.format == 'dot' or
+                            options.diff or options.git):
+        opar.error("--archive cannot be used with --dot, --diff, --git or "
+                   "--transitive")
+    if (options.baseline or options.write_baseline) and (
+            options.format == 'dot'):
+        opar.error("baselines cannot be used with --dot")
+
+
+def _run(options, args, changes, cache=None):
+    """Analyze the files asked for on the command line and print the
+    results, using cache unless --cache-dir gives one.
+    """
+    if options.cache_dir:
+        cache = ResultCache(options.cache_dir,
+                            options.cache_size * 1024 * 1024)
+    # Worker processes would only fill copies of the profile.
+    profile = Profile() if options.profile else None
+    results = _results(options, args, changes, cache, profile)
+    if options.baseline:
+        results = _new_results(results, Baseline(options.baseline))
+    if options.write_baseline:
+        Baseline.write(options.write_baseline, _baseline_records(results))
     else:
-        for graph in visitor.graphs.values():
-            if graph.complexity() >= options.threshold:
-                print(graph.name, graph.complexity())
+        # Name the file of each result unless a single file was asked for.
+        show_filenames = (changes is not None or len(args) > 1 or
+                          options.archive or os.path.isdir(args[0]))
+        _print_results(options, results, show_filenames)
+    if profile is not None:
+        profile.report(sys.stderr, options.profile)
+    if cache is not None:
+        cache.evict()
+
+
+def _results(options, args, changes, cache, profile):
+    """Return (filename, results, error) for the files asked for"""
+    jobs = 1 if profile else options.jobs
+    analyze = functools.partial(_analyze_file, dot=options.format == 'dot',
+                                threshold=options.threshold, cache=cache,
+                                changes=changes, profile=profile)
+    if options.transitive:
+        results = _transitive_results(args, options.threshold)
+    elif options.archive:
+        analyze = functools.partial(_analyze_member,
+                                    threshold=options.threshold, cache=cache,
+                                    profile=profile)
+        results = _map_files(analyze, _archive_members(args), jobs)
+    else:
+        results = _map_files(analyze, _iter_python_files(args), jobs)
+    return results
+
+
+def _new_results(results, baseline):
+    """Leave the records baseline allows out of results"""
+    for filename, records, error in results:
+        yield filename, [record for record in records
+                         if not baseline.allows(record.filename,
+                                                record.entity,
+                                                record.complexity)], error
+
+
+def _baseline_records(results):
+    """Yield the records of results, reporting errors on stderr"""
+    for filename, records, error in results:
+        if error:
+            sys.stderr.write(error)
+        for record in records:
+            yield record
+
+
+def _print_results(options, results, show_filenames):
+    print_results = _PRINTERS.get(options.format) or functools.partial(
+        _print_complexity, show_filenames=show_filenames)
+    out = open_output(options.output) if options.output else sys.stdout
+    try:
+        print_results(results, out)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+def _run_command(request, cache):
+    """Run a client's command line in its directory, capturing its output"""
+    saved = os.getcwd(), sys.stdin, sys.stdout, sys.stderr
+    sys.stdin = io.StringIO(request.get('stdin', ''))
+    sys.stdout, sys.stderr = io.StringIO(), io.StringIO()
+    status = 0
+    try:
+        os.chdir(request['cwd'])
+        options, args, changes = _parse_args(request['argv'], True)
+        # Worker processes would only update copies of the memory cache.
+        _run(options, args, changes, cache if options.jobs == 1 else None)
+    except SystemExit:
+        status = sys.exc_info()[1].code
+        if not isinstance(status, int):
+            sys.stderr.write('%s\n' % (status,) if status else '')
+            status = 1 if status else 0
+    except Exception:
+        import traceback
+        traceback.print_exc()
+        status = 1
+    finally:
+        response = {'stdout': sys.stdout.getvalue(),
+                    'stderr': sys.stderr.getvalue(), 'status': status}
+        os.chdir(saved[0])
+        sys.stdin, sys.stdout, sys.stderr = saved[1:]
+    return response
+
+
+def _answer(request, cache):
+    """Return the server's response to a request"""
+    if 'code' not in request:
+        return _run_command(request, cache)
+    filename = request.get('filename', 'stdin')
+    try:
+        records = _data_records(request['code'].encode('utf-8'), filename,
+                                cache)
+    except SyntaxError:
+        e = sys.exc_info()[1]
+        return {'error': "Unable to parse %s: %s" % (filename, e)}
+    cache.evict()
+    return {'records': [list(record) for record in records]}
+
+
+def make_server(socket_path, cache=None):
+    """Return a server listening on the Unix socket at socket_path.
+
+    Each line a client sends is a JSON request, answered by a line of
+    JSON.  ``{"argv": [...], "cwd": ..., "stdin": ...}`` runs a command
+    line, and is answered with its ``stdout``, ``stderr`` and exit
+    ``status``.  ``{"code": ..., "filename": ...}`` analyzes source text,
+    and is answered with its ``records`` (ComplexityRecords as lists) or
+    an ``error``.  Results are kept in cache (a MemoryCache by default)
+    across requests.  Requests are answered one at a time, as running a
+    command line changes the working directory and sys.stdout.
+    """
+    import json
+    import socketserver
+
+    class RequestHandler(socketserver.StreamRequestHandler):
+        def handle(self):
+            for line in self.rfile:
+                response = _answer(json.loads(line.decode('utf-8')),
+                                   self.server.cache)
+                self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+                self.wfile.flush()
+
+    server = socketserver.UnixStreamServer(socket_path, RequestHandler)
+    server.cache = MemoryCache() if cache is None else cache
+    return server
+
+
+def serve(socket_path, cache=None):
+    """Answer requests on the Unix socket at socket_path until interrupted"""
+    server = make_server(socket_path, cache)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(socket_path)
+
+
+def request(socket_path, message):
+    """Send a request to the server at socket_path, return its response"""
+    import json
+    import socket
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    with sock:
+        sock.connect(socket_path)
+        with sock.makefile('rwb') as f:
+            f.write(json.dumps(message).encode('utf-8') + b'\n')
+            f.flush()
+            return json.loads(f.readline().decode('utf-8'))
+
+
+def client(socket_path, argv, stdin=None):
+    """Run a command line on the server at socket_path, print its output
+    and return its exit status.
+    """
+    message = {'argv': argv, 'cwd': os.getcwd()}
+    if stdin is not None:
+        message['stdin'] = stdin
+    response = request(socket_path, message)
+    sys.stdout.write(response['stdout'])
+    sys.stderr.write(response['stderr'])
+    return response['status']
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    options, args, changes = _parse_args(argv)
+    if options.serve:
+        serve(options.serve)
+    elif options.connect:
+        stdin = sys.stdin.read() if options.diff == '-' else None
+        sys.exit(client(options.connect, argv, stdin))
+    else:
+        _run(options, args, changes)
 
 
 if __name__ == '__main__':
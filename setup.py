@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 from __future__ import with_statement
 
+import os
+
 from setuptools import setup
 
 
@@ -19,6 +21,15 @@ def get_long_description():
     return "\n\n".join(descr)
 
 
+def get_ext_modules():
+    # The accelerator is plain Python unless it is compiled on request.
+    if os.environ.get("MCCABE_MYPYC") != "1":
+        return []
+    from mypyc.build import mypycify
+    # Only the accelerator is compiled; mccabe itself is not annotated.
+    return mypycify(["--follow-imports=silent", "_mccabe_speedups.py"])
+
+
 setup(
     name="mccabe",
     version=get_version(),
@@ -31,7 +42,8 @@ setup(
     maintainer_email="graffatcolmingov@gmail.com",
     url="https://github.com/pycqa/mccabe",
     license="Expat license",
-    py_modules=["mccabe"],
+    py_modules=["mccabe", "_mccabe_speedups"],
+    ext_modules=get_ext_modules(),
     zip_safe=False,
     entry_points={
         "flake8.extension": [
@@ -1,5 +1,21 @@
+import ast
+import asyncio
+import glob
+import gzip
+import io
+import json
+import os
+import shutil
+import socket
+import subprocess
+import tarfile
+import tempfile
+import threading
 import unittest
 import sys
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stderr, redirect_stdout
 
 try:
     from StringIO import StringIO
@@ -216,6 +232,1172 @@ class McCabeTestCase(unittest.TestCase):
         self.assertEqual(complexity, 1)
 
 
+def graph_summary(visitor_class, tree, engine='preorder'):
+    """Map each graph key to the observable fields of its graph."""
+    visitor = visitor_class()
+    getattr(visitor, engine)(tree, visitor)
+    return dict(
+        (key, (g.name, g.entity, g.lineno, g.column, g.complexity()))
+        for key, g in visitor.graphs.items()
+    )
+
+
+def assert_same_graphs(tree):
+    """The counting visitor must agree with the graphing visitor."""
+    expected = graph_summary(mccabe.PathGraphingAstVisitor, tree)
+    actual = graph_summary(mccabe.PathCountingAstVisitor, tree)
+    assert actual == expected
+
+
+class PathCountingTests(unittest.TestCase):
+    def test_snippets(self):
+        for snippet in (trivial, expr_as_statement, sequential,
+                        sequential_unencapsulated, if_elif_else_dead_path,
+                        for_loop, for_else, recursive, nested_functions,
+                        try_else, async_keywords, annotated_assign):
+            assert_same_graphs(ast.parse(snippet))
+
+    def test_stdlib_corpus(self):
+        stdlib = os.path.dirname(os.__file__)
+        for filename in sorted(glob.glob(os.path.join(stdlib, '*.py'))):
+            try:
+                tree = compile(mccabe._read(filename), filename, "exec",
+                               ast.PyCF_ONLY_AST)
+            except (SyntaxError, ValueError):
+                continue
+            assert_same_graphs(tree)
+
+    def test_pruned_statements_are_counted(self):
+        code = ('TABLE = [1, 2, 3]\n\n\nclass C:\n    X = 1\n    Y = 2\n\n'
+                '    def f(self, x):\n        y = x\n        if y:\n'
+                '            z = 1\n            return z\n        return x\n')
+        tree = ast.parse(code)
+        sizes = []
+        for visitor_class in (mccabe.PathGraphingAstVisitor,
+                              mccabe.PathCountingAstVisitor):
+            visitor = visitor_class()
+            visitor.preorder(tree, visitor)
+            sizes.append(dict((key, graph.size())
+                              for key, graph in visitor.graphs.items()))
+        self.assertEqual(sizes[0], sizes[1])
+        self.assertEqual(sizes[1]['C.f'], (7, 7))
+
+    def test_overrides_see_simple_statements(self):
+        tree = ast.parse(sequential + 'X = [1, 2]\n')
+        for visitor_class in (mccabe.PathGraphingAstVisitor,
+                              mccabe.PathCountingAstVisitor):
+            visited = []
+
+            class Visitor(visitor_class):
+                def visitSimpleStatement(self, node):
+                    visited.append(node.lineno)
+                    super().visitSimpleStatement(node)
+
+            visitor = Visitor()
+            visitor.preorder(tree, visitor)
+            self.assertEqual(visitor.graphs['f'].complexity(), 1)
+            self.assertEqual(visited, [2, 3, 4, 5])
+
+            visited = []
+
+            class DefaultVisitor(visitor_class):
+                def default(self, node, *args):
+                    if isinstance(node, ast.stmt):
+                        visited.append(node.lineno)
+                    super().default(node, *args)
+
+            visitor = DefaultVisitor()
+            visitor.preorder(tree, visitor)
+            self.assertEqual(visited, [2, 3, 4, 5])
+
+
+class IterativeWalkTests(unittest.TestCase):
+    def test_same_graphs_as_recursive_walk(self):
+        for snippet in (nested_functions, try_else, async_keywords):
+            tree = ast.parse(snippet)
+            for visitor_class in (mccabe.PathGraphingAstVisitor,
+                                  mccabe.PathCountingAstVisitor):
+                self.assertEqual(
+                    graph_summary(visitor_class, tree, 'iterative_preorder'),
+                    graph_summary(visitor_class, tree))
+
+    def test_super_calling_subclass(self):
+        tree = ast.parse('def f(x):\n    if x:\n        return 1\n'
+                         '    return 2\n')
+        for visitor_class in (mccabe.PathGraphingAstVisitor,
+                              mccabe.PathCountingAstVisitor):
+            class Visitor(visitor_class):
+                ifs = 0
+
+                def visitIf(self, node):
+                    self.ifs += 1
+                    super().visitIf(node)
+
+            for engine in ('preorder', 'iterative_preorder'):
+                visitor = Visitor()
+                getattr(visitor, engine)(tree, visitor)
+                self.assertEqual(visitor.ifs, 1)
+                self.assertEqual(visitor.graphs['f'].complexity(), 2)
+
+    def test_long_elif_chain(self):
+        code = 'def f(x):\n    if x == 0:\n        pass\n' + ''.join(
+            '    elif x == %d:\n        pass\n' % i for i in range(1, 1000))
+        tree = compile(code, 'elif.py', 'exec', ast.PyCF_ONLY_AST)
+        for visitor_class in (mccabe.PathGraphingAstVisitor,
+                              mccabe.PathCountingAstVisitor):
+            visitor = visitor_class()
+            visitor.iterative_preorder(tree, visitor)
+            self.assertEqual(visitor.graphs['f'].complexity(), 1001)
+
+
+class MainTests(unittest.TestCase):
+    def setUp(self):
+        self._orig_stdout = sys.stdout
+        sys.stdout = self.strio = StringIO()
+        self.tmpdir = tempfile.mkdtemp()
+        for name, snippet in (('a.py', sequential), ('b.py', for_loop),
+                              (os.path.join('pkg', 'c.py'), recursive)):
+            self.write(name, snippet)
+
+    def tearDown(self):
+        self.strio.close()
+        sys.stdout = self._orig_stdout
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, name, code):
+        path = os.path.join(self.tmpdir, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(code)
+        return path
+
+    def test_single_file(self):
+        mccabe.main([os.path.join(self.tmpdir, 'b.py')])
+        self.assertEqual(self.strio.getvalue(), "1:0: 'f' 2\n")
+
+    def test_directory(self):
+        mccabe.main(['--min', '2', self.tmpdir])
+        self.assertEqual(self.strio.getvalue(), "".join(
+            "%s:1:0: 'f' 2\n" % os.path.join(self.tmpdir, name)
+            for name in ('b.py', os.path.join('pkg', 'c.py'))))
+
+    def test_jobs_keep_order(self):
+        mccabe.main([self.tmpdir])
+        serial = self.strio.getvalue()
+        self.strio.seek(0)
+        self.strio.truncate()
+        mccabe.main(['--jobs', '2', self.tmpdir])
+        self.assertEqual(self.strio.getvalue(), serial)
+        self.assertEqual(len(serial.splitlines()), 3)
+
+    def test_missing_file(self):
+        missing = os.path.join(self.tmpdir, 'missing.py')
+        errors = StringIO()
+        with redirect_stderr(errors):
+            mccabe.main([missing, os.path.join(self.tmpdir, 'b.py')])
+        self.assertIn('Unable to read %s' % missing, errors.getvalue())
+        self.assertTrue(self.strio.getvalue().endswith("'f' 2\n"))
+
+    def test_map_files_keeps_order(self):
+        self.assertEqual(list(mccabe._map_files(str, range(100), jobs=2)),
+                         [str(i) for i in range(100)])
+
+    def test_jsonl(self):
+        mccabe.main(['--format', 'jsonl', '--min', '2', self.tmpdir])
+        records = [json.loads(line)
+                   for line in self.strio.getvalue().splitlines()]
+        self.assertEqual(records[0], {
+            'filename': os.path.join(self.tmpdir, 'b.py'), 'entity': 'f',
+            'lineno': 1, 'column': 0, 'complexity': 2, 'name': "1:0: 'f'"})
+        self.assertEqual(len(records), 2)
+
+    def test_sarif(self):
+        mccabe.main(['--format', 'sarif', '--min', '2', self.tmpdir])
+        [run] = json.loads(self.strio.getvalue())['runs']
+        self.assertEqual(run['tool']['driver']['name'], 'mccabe')
+        result = run['results'][0]
+        self.assertEqual(result['properties'],
+                         {'entity': 'f', 'complexity': 2})
+        location = result['locations'][0]['physicalLocation']
+        self.assertTrue(location['artifactLocation']['uri'].endswith('/b.py'))
+        self.assertEqual(location['region'],
+                         {'startLine': 1, 'startColumn': 1})
+        self.assertEqual(len(run['results']), 2)
+
+    def test_empty_sarif(self):
+        mccabe.main(['--format', 'sarif', '--min', '99', self.tmpdir])
+        [run] = json.loads(self.strio.getvalue())['runs']
+        self.assertEqual(run['results'], [])
+
+    def test_profile(self):
+        report = StringIO()
+        with redirect_stderr(report):
+            mccabe.main(['--profile', '2', '--jobs', '2', self.tmpdir])
+        self.assertEqual(len(self.strio.getvalue().splitlines()), 3)
+        self.assertTrue(report.getvalue().startswith('3 files: parse '))
+        self.assertIn("'f' (", report.getvalue())
+
+
+class ResultCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache = mccabe.ResultCache(os.path.join(self.tmpdir, 'cache'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_round_trip(self):
+        key = self.cache.key(b'def f(): pass\n')
+        self.assertIsNone(self.cache.get(key))
+        self.cache.set(key, [("1:0: 'f'", 'f', 1, 0, 1)])
+        self.assertEqual(self.cache.get(key), [("1:0: 'f'", 'f', 1, 0, 1)])
+
+    def test_key_depends_on_contents(self):
+        self.assertNotEqual(self.cache.key(b'a = 1\n'),
+                            self.cache.key(b'a = 2\n'))
+
+    def test_evict(self):
+        self.cache.max_size = 0
+        key = self.cache.key(b'')
+        self.cache.set(key, [])
+        self.cache.evict()
+        self.assertIsNone(self.cache.get(key))
+
+    def test_cached_file_is_not_parsed(self):
+        path = os.path.join(self.tmpdir, 'a.py')
+        with open(path, 'w') as f:
+            f.write(for_loop)
+        record = mccabe.ComplexityRecord(path, 'f', 1, 0, 2, "1:0: 'f'")
+        self.assertEqual(mccabe._file_records(path, self.cache), [record])
+        with open(path, 'rb') as f:
+            key = self.cache.key(f.read())
+        self.assertEqual(self.cache.get(key), [record[1:]])
+        self.cache.set(key, [record._replace(complexity=42)[1:]])
+        self.assertEqual(mccabe._file_records(path, self.cache),
+                         [record._replace(complexity=42)])
+
+
+class ReadTests(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.py')
+        os.close(fd)
+
+    def tearDown(self):
+        os.unlink(self.path)
+
+    def write(self, data):
+        with open(self.path, 'wb') as f:
+            f.write(data)
+
+    def test_newlines(self):
+        self.write(b'a = 1\r\nb = 2\rc = 3\n')
+        self.assertEqual(mccabe._read(self.path), 'a = 1\nb = 2\nc = 3\n')
+
+    def test_declared_encoding(self):
+        data = b'# -*- coding: cp1252 -*-\ns = "\x80"\n'
+        self.write(data)
+        self.assertEqual(mccabe._read(self.path), data.decode('cp1252'))
+        self.assertIs(mccabe._source(data), data)
+
+    def test_improper_encoding_falls_back_to_latin1(self):
+        data = b'# -*- coding: bogus -*-\ns = "\xe9"\n'
+        self.write(data)
+        self.assertEqual(mccabe._read(self.path), data.decode('latin-1'))
+        self.assertEqual(mccabe._source(data), data.decode('latin-1'))
+
+    def test_source_bytes(self):
+        self.write(b'\xef\xbb\xbf' + for_loop.encode('utf-8'))
+        records = mccabe._file_records(self.path)
+        self.assertEqual([(r.entity, r.complexity) for r in records],
+                         [('f', 2)])
+
+
+class ArchiveTests(unittest.TestCase):
+    members = [('pkg/__init__.py', b''),
+               ('pkg/loop.py', for_loop.encode('utf-8')),
+               ('pkg/latin.py', b'# -*- coding: bogus -*-\n' +
+                if_elif_else_dead_path.encode('utf-8') + b's = "\xe9"\n'),
+               ('pkg/broken.py', b'def f(:\n'),
+               ('pkg/data.txt', b'def f(:\n')]
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.zip = os.path.join(self.tmpdir, 'pkg-1.0-py3-none-any.whl')
+        with zipfile.ZipFile(self.zip, 'w') as z:
+            for name, data in self.members:
+                z.writestr(name, data)
+        self.tar = os.path.join(self.tmpdir, 'pkg-1.0.tar.gz')
+        with tarfile.open(self.tar, 'w:gz') as tar:
+            for name, data in self.members:
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_iter_archive_complexity(self):
+        errors = StringIO()
+        with redirect_stderr(errors):
+            records = list(mccabe.iter_archive_complexity([self.zip,
+                                                           self.tar], 2))
+        self.assertEqual(
+            [(r.filename, r.entity, r.complexity) for r in records],
+            [(os.path.join(archive, 'pkg', name), 'f', complexity)
+             for archive in (self.zip, self.tar)
+             for name, complexity in (('loop.py', 2), ('latin.py', 3))])
+        self.assertEqual(errors.getvalue().count('Unable to parse'), 2)
+
+    def test_main(self):
+        bad = os.path.join(self.tmpdir, 'bad.zip')
+        with open(bad, 'wb') as f:
+            f.write(b'not an archive')
+        out, err = StringIO(), StringIO()
+        with redirect_stdout(out), redirect_stderr(err):
+            mccabe.main(['--archive', '--min', '3', self.tar, bad])
+        self.assertEqual(out.getvalue(), "%s:2:0: 'f' 3\n" % os.path.join(
+            self.tar, 'pkg', 'latin.py'))
+        self.assertIn('Unable to read %s' % bad, err.getvalue())
+        self.assertIn('Unable to parse %s' % os.path.join(
+            self.tar, 'pkg', 'broken.py'), err.getvalue())
+
+    def test_main_rejects_changes(self):
+        for option in (['--diff', '-'], ['--git', 'HEAD']):
+            err = StringIO()
+            with redirect_stderr(err), self.assertRaises(SystemExit):
+                mccabe.main(['--archive'] + option + [self.tar])
+            self.assertIn('--archive cannot be used with', err.getvalue())
+
+
+class ComplexityRecordTests(unittest.TestCase):
+    def test_iter_code_complexity(self):
+        records = list(mccabe.iter_code_complexity(try_else, 'try.py'))
+        self.assertEqual(records, [mccabe.ComplexityRecord(
+            'try.py', 'TryExcept 1', 1, 0, 4, 'TryExcept 1')])
+
+    def test_iter_code_complexity_syntax_error(self):
+        self.assertRaises(SyntaxError, mccabe.iter_code_complexity,
+                          'def f(:\n', 'bad.py')
+
+    def test_iter_complexity(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        filenames = []
+        for name, code in (('a.py', for_loop), ('bad.py', 'def f(:\n'),
+                           ('b.py', nested_functions)):
+            filenames.append(os.path.join(tmpdir, name))
+            with open(filenames[-1], 'w') as f:
+                f.write(code)
+        filenames.insert(1, os.path.join(tmpdir, 'missing.py'))
+        errors = StringIO()
+        with redirect_stderr(errors):
+            records = list(mccabe.iter_complexity(iter(filenames)))
+        self.assertEqual(
+            [(r.filename, r.entity, r.complexity) for r in records],
+            [(filenames[0], 'f', 2), (filenames[3], 'a', 3)])
+        self.assertIn('Unable to read', errors.getvalue())
+        self.assertIn('Unable to parse', errors.getvalue())
+
+    def test_iter_modules_complexity(self):
+        tree = ast.parse(nested_functions)
+        modules = [('a.py', tree), ('bad.py', 'def f(:\n'),
+                   ('b.py', for_loop.encode('utf-8'))]
+        errors = StringIO()
+        with redirect_stderr(errors):
+            records = list(mccabe.iter_modules_complexity(modules))
+        self.assertEqual(
+            [(r.filename, r.entity, r.complexity) for r in records],
+            [('a.py', 'a', 3), ('b.py', 'f', 2)])
+        self.assertIn('Unable to parse bad.py', errors.getvalue())
+
+    def test_dispatch_table_is_shared(self):
+        first = mccabe.PathCountingAstVisitor()
+        second = mccabe.PathCountingAstVisitor()
+        self.assertIs(first._cache, second._cache)
+        self.assertIsNot(first._cache, mccabe.PathGraphingAstVisitor()._cache)
+
+    def test_instance_visit_methods_are_called(self):
+        visited = []
+        visitor = mccabe.ASTVisitor()
+        visitor.visitReturn = visited.append
+        tree = ast.parse('def f(x):\n    if x:\n        return 1\n    return 2\n')
+        visitor.preorder(tree, visitor)
+        self.assertEqual(len(visited), 2)
+        self.assertIsNot(visitor._cache, mccabe.ASTVisitor()._cache)
+        other = mccabe.ASTVisitor()
+        other.preorder(tree, other)
+        self.assertEqual(len(visited), 2)
+
+
+class IncrementalAnalyzerTests(unittest.TestCase):
+    code = '\n'.join((sequential, for_loop, 'class C:',
+                      '    ' + recursive.replace('\n', '\n    '), try_else))
+
+    def assert_fresh(self, analyzer, code):
+        self.assertEqual(analyzer.update(code),
+                         list(mccabe.iter_code_complexity(code, 'mod.py')))
+
+    def test_unchanged(self):
+        analyzer = mccabe.IncrementalAnalyzer('mod.py')
+        self.assert_fresh(analyzer, self.code)
+        self.assertEqual(analyzer.recomputed, 4)
+        self.assert_fresh(analyzer, self.code)
+        self.assertEqual(analyzer.recomputed, 0)
+
+    def test_changed_function(self):
+        analyzer = mccabe.IncrementalAnalyzer('mod.py')
+        analyzer.update(self.code)
+        code = self.code.replace('print(i)', 'if i:\n            print(i)')
+        self.assert_fresh(analyzer, code)
+        self.assertEqual(analyzer.recomputed, 1)
+
+    def test_moved_functions(self):
+        analyzer = mccabe.IncrementalAnalyzer('mod.py')
+        analyzer.update(self.code)
+        self.assert_fresh(analyzer, 'import os\n\n' + self.code)
+        self.assertEqual(analyzer.recomputed, 0)
+
+    def test_form_feed_is_not_a_line_break(self):
+        # A form feed is whitespace to the parser, not a line break.
+        code = 'x = 1\n\x0c\ndef f(x):\n    y = 1\n    return x\n'
+        analyzer = mccabe.IncrementalAnalyzer('mod.py')
+        analyzer.update(code)
+        self.assert_fresh(analyzer, code.replace('    return x\n',
+                                                 '    for i in x: pass\n'))
+        self.assertEqual(analyzer.recomputed, 1)
+
+
+changed_module = """\
+def a():
+    pass
+
+
+def b(x):
+    if x:
+        return 1
+    return 2
+
+
+class C:
+    def c(self):
+        pass
+
+    @property
+    def d(self):
+        for i in self:
+            pass
+"""
+
+module_diff = """\
+diff --git a/mod.py b/mod.py
+index 1111111..2222222 100644
+--- a/mod.py
++++ b/mod.py
+@@ -5,2 +5,4 @@ def a():
+ def b(x):
+-    return 2
++    if x:
++        return 1
++    return 2
+@@ -14 +15,0 @@ class C:
+-        pass
+diff --git a/gone.py b/gone.py
+deleted file mode 100644
+--- a/gone.py
++++ /dev/null
+@@ -1 +0,0 @@
+-x = 1
+"""
+
+
+@pytest.mark.skipif(not hasattr(socket, 'AF_UNIX'),
+                    reason="Unix sockets are not available")
+class ServerTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'a.py')
+        with open(self.path, 'w') as f:
+            f.write(for_loop)
+        self.socket_path = os.path.join(self.tmpdir, 'mccabe.sock')
+        self.server = mccabe.make_server(self.socket_path)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.thread.join()
+        self.server.server_close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_command_line(self):
+        out = StringIO()
+        with redirect_stdout(out):
+            status = mccabe.client(self.socket_path, [self.path])
+        self.assertEqual(out.getvalue(), "1:0: 'f' 2\n")
+        self.assertEqual(status, 0)
+        self.assertIsNotNone(self.server.cache.get(
+            self.server.cache.key(for_loop.encode('utf-8'))))
+
+    def test_bad_command_line(self):
+        response = mccabe.request(self.socket_path, {
+            'argv': ['--jobs', '-1', self.path], 'cwd': self.tmpdir})
+        self.assertEqual(response['status'], 2)
+        self.assertIn('--jobs must not be negative', response['stderr'])
+
+    def test_code(self):
+        response = mccabe.request(self.socket_path,
+                                  {'code': for_loop, 'filename': 'b.py'})
+        self.assertEqual(response, {'records': [
+            ['b.py', 'f', 1, 0, 2, "1:0: 'f'"]]})
+        response = mccabe.request(self.socket_path, {'code': 'def f(:'})
+        self.assertTrue(response['error'].startswith('Unable to parse stdin'))
+
+    def test_code_requests_evict(self):
+        self.server.cache.max_entries = 3
+        for i in range(50):
+            mccabe.request(self.socket_path, {'code': 'x = %d\n' % i})
+        self.assertEqual(len(self.server.cache._results), 3)
+
+
+class DiffTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmpdir)
+        with open('mod.py', 'w') as f:
+            f.write(changed_module)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmpdir)
+
+    def test_parse_diff(self):
+        self.assertEqual(mccabe.parse_diff(module_diff),
+                         {'mod.py': [(6, 8), (15, 16)]})
+
+    def test_replaced_lines_do_not_mark_the_line_before(self):
+        with open('adj.py', 'w') as f:
+            f.write('def f():\n    return 1\ndef g():\n    return 2\n')
+        changes = mccabe.parse_diff(
+            '--- a/adj.py\n+++ b/adj.py\n@@ -3 +3 @@\n'
+            '-def g():\n+def g(x=1):\n')
+        self.assertEqual(changes, {'adj.py': [(3, 3)]})
+        records = mccabe.iter_changed_complexity(changes)
+        self.assertEqual([r.entity for r in records], ['g'])
+
+    def test_iter_changed_complexity(self):
+        records = mccabe.iter_changed_complexity(
+            mccabe.parse_diff(module_diff))
+        self.assertEqual([(r.entity, r.complexity) for r in records],
+                         [('b', 2), ('C.d', 2)])
+
+    def test_decorator_lines_belong_to_the_function(self):
+        records = mccabe.iter_changed_complexity({'mod.py': [(15, 15)]})
+        self.assertEqual([r.entity for r in records], ['C.d'])
+
+    def test_main(self):
+        with open('changes.diff', 'w') as f:
+            f.write(module_diff)
+        out = StringIO()
+        with redirect_stdout(out):
+            mccabe.main(['--diff', 'changes.diff', '--min', '2'])
+        self.assertEqual(out.getvalue(), "mod.py:5:0: 'b' 2\nmod.py:16:4: 'C.d' 2\n")
+
+    @pytest.mark.skipif(not shutil.which('git'), reason="git is not installed")
+    def test_git_changes(self):
+        def git(*args):
+            subprocess.check_call(
+                ('git', '-c', 'user.name=t', '-c', 'user.email=t@t') + args,
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        git('init', '-q')
+        git('add', 'mod.py')
+        git('commit', '-q', '-m', 'one')
+        with open('mod.py', 'a') as f:
+            f.write('        return i\n')
+        self.assertEqual(mccabe.git_changes('HEAD'), {'mod.py': [(19, 19)]})
+        records = mccabe.iter_changed_complexity(mccabe.git_changes('HEAD'))
+        self.assertEqual([r.entity for r in records], ['C.d'])
+
+
+def write_dot(tree, graph_class=mccabe.PathGraph, batch_size=1000):
+    """Return the DOT output for tree and the complexity of its graphs."""
+    visitor = mccabe.PathGraphingAstVisitor(graph_class)
+    visitor.iterative_preorder(tree, visitor)
+    out = StringIO()
+    writer = mccabe.DotWriter(out, batch_size)
+    writer.begin()
+    for graph in visitor.graphs.values():
+        graph.write_dot(writer)
+    writer.end()
+    return out.getvalue(), [g.complexity() for g in visitor.graphs.values()]
+
+
+class DotWriterTests(unittest.TestCase):
+    def write_dot(self, code, batch_size=1000):
+        return write_dot(ast.parse(code), batch_size=batch_size)[0]
+
+    def test_output(self):
+        self.assertEqual(self.write_dot(for_loop), """\
+graph {
+subgraph {
+node [shape=circle,label="1:0: 'f'"] 1;
+node [shape=circle,label="Loop 2"] 2;
+node [shape=circle,label="Stmt 3"] 3;
+node [shape=point,label=""] 4;
+1 -- 2;
+2 -- 3;
+2 -- 4;
+3 -- 4;
+}
+}
+""")
+
+    def test_deterministic(self):
+        self.assertEqual(self.write_dot(nested_functions),
+                         self.write_dot(nested_functions))
+
+    def test_batches(self):
+        self.assertEqual(self.write_dot(try_else, batch_size=1),
+                         self.write_dot(try_else))
+
+    def test_gzip_output(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        path = os.path.join(tmpdir, 'a.py')
+        with open(path, 'w') as f:
+            f.write(for_loop)
+        mccabe.main(['--dot', '--output', path + '.dot.gz', path])
+        with gzip.open(path + '.dot.gz', 'rt') as f:
+            self.assertEqual(f.read(), self.write_dot(for_loop))
+
+
+class ArrayPathGraphTests(unittest.TestCase):
+    def test_snippets(self):
+        for snippet in (trivial, sequential_unencapsulated,
+                        if_elif_else_dead_path, for_else, nested_functions,
+                        try_else, async_keywords):
+            tree = ast.parse(snippet)
+            self.assertEqual(write_dot(tree, mccabe.ArrayPathGraph),
+                             write_dot(tree))
+
+    def test_stdlib_corpus(self):
+        stdlib = os.path.dirname(os.__file__)
+        for filename in sorted(glob.glob(os.path.join(stdlib, '*.py')))[:50]:
+            try:
+                tree = compile(mccabe._read(filename), filename, "exec",
+                               ast.PyCF_ONLY_AST)
+            except (SyntaxError, ValueError):
+                continue
+            self.assertEqual(write_dot(tree, mccabe.ArrayPathGraph),
+                             write_dot(tree))
+
+    def test_to_dot(self):
+        visitor = mccabe.PathGraphingAstVisitor(mccabe.ArrayPathGraph)
+        visitor.iterative_preorder(ast.parse(for_else), visitor)
+        out = StringIO()
+        with redirect_stdout(out):
+            visitor.graphs['f'].to_dot()
+        self.assertEqual(out.getvalue(), write_dot(ast.parse(for_else))[0]
+                         .split('\n', 1)[1].rsplit('}', 1)[0])
+
+
+redefined = """\
+class C:
+    @property
+    def x(self):
+        return 1
+
+    @x.setter
+    def x(self, value):
+        if value:
+            pass
+"""
+
+flat_functions = ''.join('def f%d():\n    pass\n' % i for i in range(5))
+
+
+class StreamingTests(unittest.TestCase):
+    def test_same_graphs_as_walk(self):
+        for snippet in (sequential, nested_functions, try_else,
+                        async_keywords, redefined, for_else):
+            tree = ast.parse(snippet)
+            for visitor_class in (mccabe.PathCountingAstVisitor,
+                                  mccabe.PathGraphingAstVisitor):
+                visitor = visitor_class()
+                visitor.preorder(tree, visitor)
+                expected = [(g.name, g.complexity())
+                            for g in visitor.graphs.values()]
+                actual = [(g.name, g.complexity())
+                          for g in mccabe.iter_graphs(tree, visitor_class())]
+                self.assertEqual(actual, expected)
+
+    def test_graphs_are_not_kept(self):
+        visitor = mccabe.PathGraphingAstVisitor()
+        graphs = mccabe.iter_graphs(ast.parse(flat_functions), visitor)
+        for graph in graphs:
+            self.assertEqual(list(visitor.graphs.values()), [graph])
+        self.assertEqual(visitor.graphs, {})
+
+
+def speedup_summary(tree, visitor=None):
+    """List the observable fields of each graph iter_graphs yields."""
+    return [(g.name, g.entity, g.lineno, g.column, g.size(), g.complexity())
+            for g in mccabe.iter_graphs(tree, visitor)]
+
+
+class SpeedupsTests(unittest.TestCase):
+    def assert_same_graphs(self, tree):
+        expected = speedup_summary(tree, mccabe.PathCountingAstVisitor())
+        self.assertEqual(speedup_summary(tree), expected)
+        self.assertEqual(
+            speedup_summary(tree, mccabe.PathGraphingAstVisitor()), expected)
+
+    def test_installed(self):
+        self.assertIsNotNone(mccabe._speedups())
+
+    def test_snippets(self):
+        for snippet in (trivial, expr_as_statement, sequential,
+                        sequential_unencapsulated, if_elif_else_dead_path,
+                        for_loop, for_else, recursive, nested_functions,
+                        try_else, async_keywords, annotated_assign, redefined,
+                        long_elif_chain, changed_module, calling_module):
+            self.assert_same_graphs(ast.parse(snippet))
+
+    def test_deep_nesting(self):
+        code = 'def f(x):\n' + ''.join(
+            '    ' * (i + 1) + 'for x%d in x:\n' % i for i in range(90)) + (
+            '    ' * 91 + 'pass\n')
+        self.assert_same_graphs(ast.parse(code))
+
+    def test_stdlib_corpus(self):
+        stdlib = os.path.dirname(os.__file__)
+        for filename in sorted(glob.glob(os.path.join(stdlib, '*.py'))):
+            try:
+                tree = compile(mccabe._read(filename), filename, "exec",
+                               ast.PyCF_ONLY_AST)
+            except (SyntaxError, ValueError):
+                continue
+            self.assert_same_graphs(tree)
+
+    def test_limit(self):
+        tree = ast.parse(long_elif_chain + for_loop.replace('def f', 'def g'))
+        graphs = mccabe.iter_graphs(tree, limit=5)
+        self.assertEqual([(graph.entity, graph.complexity())
+                          for graph in graphs], [('f', 6), ('g', 2)])
+
+    def test_fallback(self):
+        code = nested_functions + try_else
+        expected = speedup_summary(ast.parse(code)), checker_errors(code, 1)
+        saved = mccabe._speedups
+        mccabe._speedups = lambda: None
+        try:
+            self.assertEqual((speedup_summary(ast.parse(code)),
+                              checker_errors(code, 1)), expected)
+        finally:
+            mccabe._speedups = saved
+
+
+class ProfileTests(unittest.TestCase):
+    def test_iter_code_complexity(self):
+        profile = mccabe.Profile()
+        records = list(mccabe.iter_code_complexity(nested_functions, 'a.py',
+                                                   profile))
+        self.assertEqual(records,
+                         list(mccabe.iter_code_complexity(nested_functions,
+                                                          'a.py')))
+        [timing] = profile.files
+        self.assertEqual((timing.filename, timing.graphs, timing.peak_nodes),
+                         ('a.py', 1, 8))
+        self.assertGreater(timing.parse, 0)
+        [graph] = profile.graphs
+        self.assertEqual(graph[:3] + graph[4:], ('a.py', 'a', 1, 8, 9))
+
+    def test_checker(self):
+        profile = mccabe.Profile()
+        checker = mccabe.McCabeChecker(ast.parse(for_loop), 'b.py',
+                                       max_complexity=1, profile=profile)
+        self.assertEqual(len(list(checker.run())), 1)
+        self.assertEqual([g.entity for g in profile.graphs], ['f'])
+        self.assertEqual(profile.files[0].parse, 0.0)
+
+    def test_checker_fail_fast(self):
+        code = for_loop + nested_functions + try_else
+        counted = []
+        speedups = mccabe._speedups()
+
+        class counting_speedups:
+            @staticmethod
+            def graph_size(node, limit=None):
+                counted.append(node)
+                return speedups.graph_size(node, limit)
+
+        profile = mccabe.Profile()
+        checker = mccabe.McCabeChecker(ast.parse(code), 'b.py',
+                                       max_complexity=1, fail_fast=True,
+                                       profile=profile)
+        saved = mccabe._speedups
+        mccabe._speedups = lambda: counting_speedups
+        try:
+            self.assertEqual(len(list(checker.run())), 1)
+        finally:
+            mccabe._speedups = saved
+        self.assertEqual(len(counted), 1)
+        self.assertEqual([g.entity for g in profile.graphs], ['f'])
+        self.assertEqual(profile.files[0].graphs, 1)
+
+    def test_graph_timer(self):
+        class TimedVisitor(mccabe.GraphTimer, mccabe.PathGraphingAstVisitor):
+            pass
+
+        profile = mccabe.Profile()
+        visitor = TimedVisitor(profile, 'c.py', mccabe.ArrayPathGraph)
+        visitor.preorder(ast.parse(try_else), visitor)
+        [graph] = profile.graphs
+        self.assertEqual((graph.entity, graph.edges - graph.nodes + 2),
+                         ('TryExcept 1', 4))
+
+    def test_report(self):
+        profile = mccabe.Profile()
+        for snippet in (for_loop, nested_functions):
+            list(mccabe.iter_code_complexity(snippet, 'm.py', profile))
+        out = StringIO()
+        profile.report(out, top=1)
+        lines = out.getvalue().splitlines()
+        self.assertTrue(lines[0].startswith('2 files: parse '))
+        self.assertEqual(lines[1], 'Slowest files:')
+        self.assertEqual(lines[3], 'Slowest functions:')
+        self.assertEqual(len(lines), 5)
+
+
+def checker_errors(snippet, max_complexity, **modes):
+    checker = mccabe.McCabeChecker(ast.parse(snippet), 'stdin',
+                                   max_complexity=max_complexity, **modes)
+    return [text for _, _, text, _ in checker.run()]
+
+
+long_elif_chain = 'def f(x):\n    if x == 0:\n        pass\n' + ''.join(
+    '    elif x == %d:\n        pass\n' % i for i in range(1, 1000))
+
+
+class EarlyExitTests(unittest.TestCase):
+    def test_limit_stops_the_walk(self):
+        tree = ast.parse(long_elif_chain + for_loop.replace('def f', 'def g'))
+        visitor = mccabe.PathCountingAstVisitor(limit=5)
+        visitor.iterative_preorder(tree, visitor)
+        self.assertEqual(visitor.graphs['f'].complexity(), 6)
+        self.assertEqual(visitor.graphs['g'].complexity(), 2)
+
+    def test_early_exit(self):
+        code = long_elif_chain + for_loop.replace('def f', 'def g')
+        self.assertEqual(checker_errors(code, 1),
+                         ["C901 'f' is too complex (1001)",
+                          "C901 'g' is too complex (2)"])
+        self.assertEqual(checker_errors(code, 1, early_exit=True),
+                         ["C901 'f' is too complex (> 1)",
+                          "C901 'g' is too complex (> 1)"])
+
+    def test_fail_fast(self):
+        code = sequential + for_loop.replace('def f', 'def g') + try_else
+        self.assertEqual(checker_errors(code, 1, fail_fast=True),
+                         ["C901 'g' is too complex (2)"])
+
+    def test_parse_options(self):
+        class options:
+            max_complexity = 3
+            max_complexity_early_exit = True
+            max_complexity_fail_fast = True
+
+        saved = vars(mccabe.McCabeChecker).copy()
+        try:
+            mccabe.McCabeChecker.parse_options(options)
+            self.assertTrue(mccabe.McCabeChecker.early_exit)
+            self.assertTrue(mccabe.McCabeChecker.fail_fast)
+        finally:
+            for name in ('max_complexity', 'early_exit', 'fail_fast'):
+                setattr(mccabe.McCabeChecker, name, saved[name])
+
+
+class BaselineTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'baseline')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def baseline(self, records):
+        mccabe.Baseline.write(self.path, records)
+        baseline = mccabe.Baseline(self.path)
+        self.addCleanup(baseline.close)
+        return baseline
+
+    def test_lookup(self):
+        records = [('pkg/m%d.py' % (i % 7), 'f%d' % i, i) for i in range(1000)]
+        baseline = self.baseline(records + [('pkg/m0.py', 'f0', 3)])
+        for filename, entity, complexity in records[1:]:
+            self.assertEqual(baseline.get(filename, entity), complexity)
+        self.assertEqual(baseline.get('pkg/m0.py', 'f0'), 3)
+        self.assertIsNone(baseline.get('pkg/m0.py', 'f1'))
+        self.assertTrue(baseline.allows('./pkg/m1.py', 'f1', 1))
+        self.assertTrue(baseline.allows(os.path.abspath('pkg/m1.py'), 'f1',
+                                        0))
+        self.assertFalse(baseline.allows('pkg/m1.py', 'f1', 2))
+        self.assertFalse(baseline.allows('pkg/m1.py', 'g', 1))
+
+    def test_empty(self):
+        self.assertIsNone(self.baseline([]).get('a.py', 'f'))
+
+    def test_not_a_baseline(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'\0' * 64)
+        self.assertRaises(ValueError, mccabe.Baseline, self.path)
+        for data in (b'', b'MCC'):
+            with open(self.path, 'wb') as f:
+                f.write(data)
+            self.assertRaises(ValueError, mccabe.Baseline, self.path)
+
+    def test_bad_option(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'\0' * 64)
+        saved = vars(mccabe.McCabeChecker).copy()
+        for path in (self.path, os.path.join(self.tmpdir, 'missing')):
+            class options:
+                max_complexity = 3
+                max_complexity_baseline = path
+
+            err = StringIO()
+            try:
+                with redirect_stderr(err), self.assertRaises(SystemExit) as cm:
+                    mccabe.McCabeChecker.parse_options(options)
+            finally:
+                mccabe.McCabeChecker.max_complexity = saved['max_complexity']
+            self.assertEqual(cm.exception.code, 2)
+            self.assertIn('--max-complexity-baseline: ', err.getvalue())
+            self.assertIn(path, err.getvalue())
+
+    def test_checker(self):
+        code = sequential + for_loop.replace('def f', 'def g') + (
+            if_elif_else_dead_path.replace('def f', 'def h'))
+        baseline = self.baseline(list(mccabe.iter_code_complexity(
+            sequential + for_loop.replace('def f', 'def g'), 'stdin')))
+        errors = ["C901 'h' is too complex (3)"]
+        self.assertEqual(checker_errors(code, 1, baseline=baseline), errors)
+        self.assertEqual(checker_errors(code, 1, baseline=baseline,
+                                        early_exit=True), errors)
+        worse = code.replace('        print(i)\n',
+                             '        if i:\n            print(i)\n')
+        self.assertEqual(checker_errors(worse, 1, baseline=baseline),
+                         ["C901 'g' is too complex (3)"] + errors)
+
+    def test_main(self):
+        source = os.path.join(self.tmpdir, 'mod.py')
+        with open(source, 'w') as f:
+            f.write(sequential)
+        mccabe.main(['--write-baseline', self.path, source])
+        with open(source, 'a') as f:
+            f.write(for_loop.replace('def f', 'def g'))
+        out = StringIO()
+        with redirect_stdout(out):
+            mccabe.main(['--baseline', self.path, source])
+        self.assertEqual(out.getvalue(), "5:0: 'g' 2\n")
+
+
+class ThreadSafetyTests(unittest.TestCase):
+    snippets = (sequential, if_elif_else_dead_path, for_loop, recursive,
+                nested_functions, try_else, async_keywords)
+
+    def test_per_instance_threshold(self):
+        self.assertEqual(checker_errors(for_loop, 1),
+                         ["C901 'f' is too complex (2)"])
+        self.assertEqual(checker_errors(for_loop, 2), [])
+        self.assertEqual(mccabe.McCabeChecker.max_complexity, -1)
+
+    def test_get_code_complexity_leaves_class_alone(self):
+        with redirect_stdout(StringIO()):
+            get_code_complexity(for_loop, 1)
+        self.assertEqual(mccabe.McCabeChecker.max_complexity, -1)
+
+    def test_concurrent_checkers(self):
+        jobs = [(snippet, threshold) for snippet in self.snippets
+                for threshold in range(5)] * 20
+        expected = [checker_errors(*job) for job in jobs]
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            actual = list(executor.map(lambda job: checker_errors(*job),
+                                       jobs))
+        self.assertEqual(actual, expected)
+
+    def test_threaded_modules(self):
+        modules = [('m%d.py' % i, self.snippets[i % len(self.snippets)])
+                   for i in range(500)]
+        for threshold in (1, 3):
+            serial = list(mccabe.iter_modules_complexity(modules, threshold))
+            threaded = list(mccabe.iter_modules_complexity(
+                modules, threshold, threads=8))
+            self.assertEqual(threaded, serial)
+            self.assertTrue(all(r.complexity >= threshold for r in serial))
+
+    def test_threaded_modules_are_taken_lazily(self):
+        taken = []
+
+        def modules():
+            for i in range(100000):
+                taken.append(i)
+                yield 'm%d.py' % i, for_loop
+
+        records = mccabe.iter_modules_complexity(modules(), threads=2)
+        self.assertEqual(next(records).filename, 'm0.py')
+        self.assertLessEqual(len(taken), 9)
+        records.close()
+        self.assertLessEqual(len(taken), 9)
+
+
+class AsyncTests(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.taken = 0
+
+    def tearDown(self):
+        self.loop.close()
+
+    async def modules(self, count):
+        snippets = ThreadSafetyTests.snippets
+        for i in range(count):
+            self.taken += 1
+            yield 'm%d.py' % i, snippets[i % len(snippets)]
+
+    async def collect(self, records, limit=None):
+        collected = []
+        async for record in records:
+            collected.append(record)
+            if len(collected) == limit:
+                break
+        await records.aclose()
+        return collected
+
+    def test_same_records(self):
+        modules = [('m%d.py' % i, snippet) for i, snippet
+                   in enumerate(ThreadSafetyTests.snippets * 10)]
+        expected = list(mccabe.iter_modules_complexity(modules, 2))
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            records = mccabe.aiter_modules_complexity(
+                self.modules(len(modules)), 2, 3, executor)
+            actual = self.loop.run_until_complete(self.collect(records))
+        self.assertEqual(sorted(actual), sorted(expected))
+
+    def test_backpressure(self):
+        records = mccabe.aiter_modules_complexity(self.modules(100),
+                                                  concurrency=4)
+        actual = self.loop.run_until_complete(self.collect(records, 1))
+        self.assertEqual(len(actual), 1)
+        # the modules in flight, and the next one being fetched
+        self.assertLessEqual(self.taken, 5)
+
+    def test_slow_source(self):
+        async def first_before_exhausted():
+            released = asyncio.Event()
+
+            async def modules():
+                yield 'm0.py', ThreadSafetyTests.snippets[0]
+                await released.wait()
+                yield 'm1.py', ThreadSafetyTests.snippets[0]
+
+            records = mccabe.aiter_modules_complexity(modules())
+            first = await asyncio.wait_for(records.__anext__(), 10)
+            released.set()
+            return [first] + await self.collect(records)
+
+        actual = self.loop.run_until_complete(first_before_exhausted())
+        self.assertEqual(actual[0].filename, 'm0.py')
+        self.assertEqual(actual[-1].filename, 'm1.py')
+
+
+calling_module = """\
+from .helpers import util
+
+
+def a(x):
+    if x:
+        return b(x)
+    return 0
+
+
+def b(x):
+    if x:
+        return a(x - 1)
+    return C.m(C(), x)
+
+
+class C:
+    def __init__(self):
+        self.x = 1
+
+    def m(self, x):
+        if x:
+            return self.n(x)
+        return util(x)
+
+    def n(self, x):
+        return x
+"""
+
+helpers_module = """\
+def util(x):
+    if x:
+        return 1
+    return 2
+"""
+
+
+class CallGraphTests(unittest.TestCase):
+    def totals(self):
+        calls = mccabe.CallGraph()
+        calls.add_module(calling_module, 'pkg.mod', 'pkg/mod.py')
+        calls.add_module(helpers_module, 'pkg.helpers', 'pkg/helpers.py')
+        return dict((r.entity, r.complexity) for r in calls.iter_records())
+
+    def test_transitive_complexity(self):
+        totals = self.totals()
+        # a and b call each other, so both reach the same functions.
+        self.assertEqual(totals['a'], 2 + 2 + 1 + 2 + 1 + 2)
+        self.assertEqual(totals['a'], totals['b'])
+        self.assertEqual(totals['C.m'], 2 + 1 + 2)
+        self.assertEqual(totals['C.__init__'], 1)
+        self.assertEqual(totals['util'], 2)
+
+    def test_unresolved_calls_are_ignored(self):
+        calls = mccabe.CallGraph()
+        calls.add_module(calling_module, 'pkg.mod', 'pkg/mod.py')
+        totals = dict((r.entity, r.complexity) for r in calls.iter_records())
+        self.assertEqual(totals['C.m'], 2 + 1)
+
+    def test_main(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            os.makedirs(os.path.join(tmpdir, 'pkg'))
+            for name, code in (('__init__.py', ''), ('mod.py', calling_module),
+                               ('helpers.py', helpers_module)):
+                with open(os.path.join(tmpdir, 'pkg', name), 'w') as f:
+                    f.write(code)
+            out = StringIO()
+            with redirect_stdout(out):
+                mccabe.main(['--transitive', '--min', '5', tmpdir])
+        finally:
+            shutil.rmtree(tmpdir)
+        self.assertEqual(sorted(line.split(': ', 1)[1]
+                                for line in out.getvalue().splitlines()),
+                         ["'C.m' 5", "'a' 10", "'b' 10"])
+
+    def test_main_rejects_ignored_options(self):
+        for option in (['--dot'], ['--diff', '-'], ['--git', 'HEAD'],
+                       ['--jobs', '2'], ['--cache-dir', 'cache']):
+            err = StringIO()
+            with redirect_stderr(err), self.assertRaises(SystemExit):
+                mccabe.main(['--transitive'] + option + ['.'])
+            self.assertIn('--transitive cannot be used with', err.getvalue())
+
+
 class RegressionTests(unittest.TestCase):
     def setUp(self):
         self.original_complexity = mccabe.McCabeChecker.max_complexity
@@ -231,13 +1413,25 @@ class RegressionTests(unittest.TestCase):
         options = _options()
         options.max_complexity = '16'
 
-        self.assertEqual(0, mccabe.McCabeChecker.max_complexity)
+        self.assertEqual(-1, mccabe.McCabeChecker.max_complexity)
         mccabe.McCabeChecker.parse_options(options)
         self.assertEqual(16, mccabe.McCabeChecker.max_complexity)
 
     def test_get_module_complexity(self):
         self.assertEqual(0, mccabe.get_module_complexity("mccabe.py"))
 
+    def test_import_is_lazy(self):
+        code = ("import sys; before = set(sys.modules); import mccabe; "
+                "print(' '.join(sorted(set(sys.modules) - before)))")
+        here = os.path.dirname(os.path.abspath(mccabe.__file__))
+        output = subprocess.check_output([sys.executable, '-c', code],
+                                         cwd=here, universal_newlines=True)
+        imported = output.split()
+        self.assertIn('mccabe', imported)
+        for name in ('asyncio', 'concurrent.futures', 'json', 'optparse',
+                     'socket', 'subprocess', 'tokenize'):
+            self.assertNotIn(name, imported)
+
 
 # This test uses the Hypothesis and Hypothesmith libraries to generate random
 # syntatically-valid Python source code and applies McCabe on it.
@@ -273,6 +1467,12 @@ def test_idempotent_any_syntatically_valid_python(
     # Then try to apply get_complexity_number to the code...
     get_code_complexity(src_contents, max_complexity)
 
+    # ...and check that both visitors and the accelerator agree on it.
+    tree = ast.parse(src_contents)
+    assert_same_graphs(tree)
+    assert speedup_summary(tree) == speedup_summary(
+        tree, mccabe.PathCountingAstVisitor())
+
 
 if __name__ == "__main__":
     test_idempotent_any_syntatically_valid_python()